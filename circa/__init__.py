@@ -1,38 +1,57 @@
 #!/usr/bin/python
+import itertools, time, importlib, collections
 
 from .core import *
-from .formats.nec import NECCode, NECBCode
-from .formats.rc5 import RC5Code
-from .formats.broadlink import BroadlinkCode, BroadlinkHexCode
-from .formats.pronto import ProntoCode
-from .devices.broadlink import BroadlinkDevice
-
-FORMATS = [
-    RawCode,
-    RawPmCode,
-    RC5Code,
-    NECCode,
-    NECBCode,
-    BroadlinkCode,
-    BroadlinkHexCode,
-    ProntoCode,
-]
-
-DEVICES = [
-    BroadlinkDevice
-]
+from . import stats as _stats
+from .stats import DecodeStats, collect_stats
+from .util import get_numpy
+from .registry import Registry
+
+# Formats and devices are only imported when first looked up (or iterated
+# over), so that e.g. converting an RC5 code does not import the Broadlink
+# device support and its dependencies.
+FORMATS = Registry("Format", "circa.formats")
+FORMATS.register(RawCode)
+FORMATS.register(RawPmCode)
+FORMATS.register(".formats.rc5:RC5Code", ["rc5"])
+FORMATS.register(".formats.nec:NECCode", ["nec"])
+FORMATS.register(".formats.nec:NECBCode", ["necb"])
+FORMATS.register(".formats.broadlink:BroadlinkCode", ["broadlink", "b64"])
+FORMATS.register(".formats.broadlink:BroadlinkHexCode", ["broadlink-hex"])
+FORMATS.register(".formats.pronto:ProntoCode", ["pronto"])
+
+DEVICES = Registry("Device", "circa.devices")
+DEVICES.register(".devices.broadlink:BroadlinkDevice", ["broadlink"])
+
+ASYNC_DEVICES = Registry("Device", "circa.async_devices")
+ASYNC_DEVICES.register(".devices.broadlink:AsyncBroadlinkDevice", ["broadlink"])
+
+_LAZY_EXPORTS = {
+    "NECCode": ".formats.nec",
+    "NECBCode": ".formats.nec",
+    "NECDecoder": ".formats.nec",
+    "RC5Code": ".formats.rc5",
+    "RC5Decoder": ".formats.rc5",
+    "BroadlinkCode": ".formats.broadlink",
+    "BroadlinkHexCode": ".formats.broadlink",
+    "ProntoCode": ".formats.pronto",
+    "BroadlinkDevice": ".devices.broadlink",
+    "AsyncBroadlinkDevice": ".devices.broadlink",
+}
+
+def __getattr__(name):
+    if name in _LAZY_EXPORTS:
+        return getattr(importlib.import_module(_LAZY_EXPORTS[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def find_format(fmtname):
-    for fmt in FORMATS:
-        if fmtname.lower() in fmt.NAMES:
-            return fmt
-    raise ParseError(f"Format type {fmtname} not supported")
+    return FORMATS.find(fmtname)
 
 def find_device(devname):
-    for dev in DEVICES:
-        if devname in dev.NAMES:
-            return dev
-    raise ParseError(f"Device type {devname} not supported")
+    return DEVICES.find(devname)
+
+def find_async_device(devname):
+    return ASYNC_DEVICES.find(devname)
 
 def from_string(s, fmtname=None):
     if fmtname is None:
@@ -43,11 +62,7 @@ def from_string(s, fmtname=None):
 def from_struct(s):
     if "format" not in s:
         raise DataError("No format defined")
-    fmtname = s["format"]
-    for fmt in FORMATS:
-        if fmtname in fmt.NAMES:
-            return fmt.from_struct(s)
-    raise ParseError(f"Format type {fmtname} not supported")
+    return find_format(s["format"]).from_struct(s)
 
 def from_template_and_data(template, data):
     fmtname, config = template.split(":", 1)
@@ -67,13 +82,10 @@ def from_generic(d):
     else:
         raise ValueError(f"Unknown code structure: {d!r}")
 
-def compare_codes(a, b):
-    a = a.to_raw().flatten().data[0]["pulses"]
-    b = b.to_raw().flatten().data[0]["pulses"]
-
+def _score_pulses(a, b):
     worst = 0
     median = sorted(a)[len(a) // 2]
-    for i, j in zip(a[:-1], b[:-1]):
+    for i, j in zip(itertools.islice(a, len(a) - 1), itertools.islice(b, len(b) - 1)):
         diff = abs(j - i) / i
         diff = diff * (min((median / i), 1) ** 0.1)
         worst = max(diff, worst)
@@ -85,33 +97,166 @@ def compare_codes(a, b):
     score *= 0.8 ** max(0, (length_diff - 1))
     return score
 
-def try_decode(code):
-    raw = code.to_raw().flatten()
+def _score_pulses_np(a, bs):
+    numpy = get_numpy()
+    ref = numpy.asarray(a[:-1], dtype=numpy.float64)
+    median = sorted(a)[len(a) // 2]
+    # numpy's vectorized pow() is not bit-exact with libm, and the weights only
+    # depend on the reference, so compute them the same way as the slow path.
+    weight = numpy.array([min((median / i), 1) ** 0.1 for i in a[:-1]], dtype=numpy.float64)
+
+    # Candidates are laid over a copy of the reference, so any positions past
+    # the end of a shorter candidate compare equal and do not contribute.
+    mat = numpy.tile(ref, (len(bs), 1))
+    for k, b in enumerate(bs):
+        n = max(0, min(len(ref), len(b) - 1))
+        mat[k, :n] = b[:n]
+    # (likewise for the length penalty)
+    penalty = numpy.array([0.8 ** max(0, (abs(len(a) - len(b)) - 1)) for b in bs], dtype=numpy.float64)
+
+    if len(ref):
+        worst = (numpy.abs(mat - ref) / ref * weight).max(axis=1)
+    else:
+        worst = numpy.zeros(len(bs))
+
+    scores = 1.0 - numpy.minimum(worst, 1.0)
+    scores *= penalty
+    return scores.tolist()
+
+def _flat_pulses(code):
+    return code.to_raw().flatten(lazy=True).data[0]["pulses"]
+
+def compare_codes(a, b):
+    return compare_codes_batch(a, [b])[0]
+
+def compare_codes_batch(ref, codes):
+    return _score_codes(_flat_pulses(ref), codes)
+
+def _score_codes(a, codes):
+    return _score_pulse_lists(a, [_flat_pulses(code) for code in codes])
+
+# Setting up the arrays costs about as much as scoring a few hundred pulses
+# in Python, so NumPy only pays off for several candidates or long codes.
+NUMPY_MIN_SCORE_PULSES = 512
+
+def _score_pulse_lists(a, bs):
+    if len(a) * len(bs) >= NUMPY_MIN_SCORE_PULSES and get_numpy() is not None:
+        return _score_pulses_np(a, bs)
+    else:
+        return [_score_pulses(a, b) for b in bs]
+
+def fingerprint(code, decode=False):
+    """Return a short hash identifying a code, for deduplication and caching.
+
+    By default this is RawCode.fingerprint() of the code's pulse train. With
+    decode=True, codes that decode to a protocol are identified by their best
+    decoding's packets instead, ignoring timing parameters and repeat counts,
+    so that any two captures of the same button hash the same.
+    """
+    if decode:
+        import hashlib
+        for score, guess in try_decode(code):
+            if not guess.RAW:
+                data = ";".join(guess._format_one_string_data(i) for i in guess.data)
+                return hashlib.blake2b(f"{guess.NAMES[0]}:{data}".encode("ascii"), digest_size=8).hexdigest()
+    return code.to_raw().fingerprint()
+
+# Number of codes each protocol format has decoded, to try likely ones first
+_hits = collections.Counter()
+
+def try_decode(code, stats=None, max_results=None, min_score=0.5, confident=None):
+    """Guess which formats a code decodes as, returning (score, code) pairs,
+    best first.
+
+    Guesses scoring under `min_score` are dropped, and at most `max_results`
+    are returned. With `confident`, decoding stops at the first protocol
+    (non-RAW) format that reaches that score. Protocol formats are then tried
+    in order of how often they matched before, and container formats last,
+    since they reproduce any code.
+    """
+    # Instrumentation is only done when a DecodeStats is passed in or active
+    # through collect_stats(); otherwise it costs one check per stage.
+    if stats is None:
+        stats = _stats.active.get()
+    if stats is not None:
+        t = time.perf_counter()
+
+    ref = _flat_pulses(code)
+    pstats = PulseStats(ref)
+
+    if stats is not None:
+        t = stats.lap("prepare", "-", t)
 
     guesses = []
 
-    for fmt in FORMATS:
+    # (the first call imports the format modules)
+    formats = list(FORMATS)
+    if confident is not None:
+        formats.sort(key=lambda fmt: (fmt.RAW, -_hits[fmt]))
+    if stats is not None:
+        t = stats.lap("formats", "-", t)
+
+    for fmt in formats:
+        name = fmt.NAMES[0]
+        if not fmt.accepts(pstats):
+            if stats is not None:
+                t = stats.lap("accepts", name, t, outcome="rejected")
+            continue
         try:
             ncode = fmt.from_code(code)
-        except Exception:
+        except Exception as e:
+            if stats is not None:
+                t = stats.lap("from_code", name, t, outcome=type(e).__name__)
             continue
+        if stats is not None:
+            t = stats.lap("from_code", name, t)
 
-        score = compare_codes(raw, ncode)
-        if score < 0.5:
+        score, = _score_codes(ref, [ncode])
+        if stats is not None:
+            t = stats.lap("compare_codes", name, t, outcome="ok" if score >= min_score else "low_score")
+        if score < min_score:
             continue
         guesses.append((score, ncode))
+        if not fmt.RAW:
+            _hits[fmt] += 1
+        done = confident is not None and not fmt.RAW and score >= confident
 
+        simple_min = max(0.7, min_score)
         best_scode = None
+        # Thresholds often agree; only re-encode and rescore when the set of
+        # simplified params changes (starting from the unsimplified code).
+        # A skipped threshold scores the same as the last code, which still
+        # ends the search if that was too low.
+        last_changes = {}
+        last_score = score
         for threshold in (0.05, 0.1, 0.15, 0.2, 0.25):
+            changes = ncode.simplified_params(threshold)
+            if changes == last_changes:
+                if stats is not None:
+                    t = stats.lap("simplify_params", name, t, threshold, "unchanged")
+                if last_score < simple_min:
+                    break
+                continue
+            last_changes = changes
             scode = ncode.clone()
             scode.simplify_params(threshold)
-            score = compare_codes(raw, scode)
-            if score < 0.7:
+            if stats is not None:
+                t = stats.lap("simplify_params", name, t, threshold)
+            score, = _score_codes(ref, [scode])
+            last_score = score
+            if stats is not None:
+                t = stats.lap("compare_codes", name, t, threshold, "ok" if score >= simple_min else "low_score")
+            if score < simple_min:
                 break
             best_scode = score, scode
             if guesses and guesses[-1][0] == score:
                 guesses.pop()
             guesses.append(best_scode)
 
+        if done:
+            break
+
     guesses.sort(reverse=True, key=lambda k: k[0])
+    if max_results is not None:
+        del guesses[max_results:]
     return guesses
@@ -0,0 +1,219 @@
+#!/usr/bin/python
+import mmap, os, struct, sys
+from array import array
+
+from .core import *
+from .util import pulse_array, freeze_packet
+
+__all__ = ["CaptureArchive", "CaptureWriter"]
+
+# File layout (all little endian):
+#
+#   header   "CIRCAARC", u32 version, u32 reserved
+#   records  u32 fc, u32 count, u32 packet_interval, u32 packets,
+#            packets * (u32 pulse count, u32 repeat count),
+#            then the pulses of all packets as u32
+#   index    u64 offset of each record (8-byte aligned)
+#   trailer  u64 index offset, u32 record count, "CIDX"
+#
+# Records are appended, and the index and trailer rewritten, when a writer
+# is closed. If that never happened, readers rebuild the index by walking
+# the records.
+
+MAGIC = b"CIRCAARC"
+VERSION = 1
+HEADER = struct.Struct("<8sII")
+RECORD = struct.Struct("<IIII")
+PACKET = struct.Struct("<II")
+TRAILER = struct.Struct("<QI4s")
+TRAILER_MAGIC = b"CIDX"
+
+NATIVE = sys.byteorder == "little"
+
+def _record_end(buf, p, size):
+    # End of the record at p, or None if it is incomplete or not a valid
+    # record (e.g. the padding or index of an interrupted writer)
+    if p + RECORD.size > size:
+        return None
+    fc, count, interval, npackets = RECORD.unpack_from(buf, p)
+    q = p + RECORD.size + npackets * PACKET.size
+    if not fc or not npackets or q > size:
+        return None
+    for i in range(npackets):
+        npulses, pcount = PACKET.unpack_from(buf, p + RECORD.size + i * PACKET.size)
+        if not npulses or npulses % 2:
+            return None
+        q += 4 * npulses
+        if q > size:
+            return None
+    return q
+
+def _read_index(buf, size, copy=False):
+    # Returns (record offsets, end of the last record). The offsets are a
+    # zero-copy view of the index unless copy is set.
+    if size >= HEADER.size + TRAILER.size:
+        index_offset, n, magic = TRAILER.unpack_from(buf, size - TRAILER.size)
+        if magic == TRAILER_MAGIC and index_offset + 8 * n == size - TRAILER.size:
+            if NATIVE and not copy:
+                offsets = memoryview(buf)[index_offset:index_offset + 8 * n].cast("Q")
+            else:
+                offsets = array("Q")
+                offsets.frombytes(buf[index_offset:index_offset + 8 * n])
+                if not NATIVE:
+                    offsets.byteswap()
+            end = _record_end(buf, offsets[-1], size) if n else HEADER.size
+            if end is not None:
+                return offsets, end
+            if isinstance(offsets, memoryview):
+                offsets.release()
+
+    # No valid index (the writer was not closed), walk the records
+    offsets = array("Q")
+    p = HEADER.size
+    while True:
+        end = _record_end(buf, p, size)
+        if end is None:
+            return offsets, p
+        offsets.append(p)
+        p = end
+
+class CaptureArchive(object):
+    """Read-only, memory-mapped capture archive.
+
+    Captures are returned as RawCodes by index (or by iterating). Their
+    pulses are read-only memoryviews into the file rather than copies, so
+    the mapping stays alive as long as any of them (or their clones) does,
+    even after close(). With `copy`, the pulses are copied out instead.
+    """
+
+    def __init__(self, path, copy=False):
+        self.copy = copy
+        self.fd = open(path, "rb")
+        self.map = None
+        self.offsets = ()
+        try:
+            if os.fstat(self.fd.fileno()).st_size < HEADER.size:
+                raise DataError(f"Not a capture archive: {path!r}")
+            self.map = mmap.mmap(self.fd.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, reserved = HEADER.unpack_from(self.map, 0)
+            if magic != MAGIC:
+                raise DataError(f"Not a capture archive: {path!r}")
+            if version != VERSION:
+                raise DataError(f"Unsupported capture archive version {version}")
+            self.offsets, end = _read_index(self.map, len(self.map))
+        except:
+            self.close()
+            raise
+
+    def close(self):
+        if isinstance(self.offsets, memoryview):
+            self.offsets.release()
+        self.offsets = ()
+        if self.map is not None:
+            try:
+                self.map.close()
+            except BufferError:
+                # Captures still reference it, it is unmapped once they are
+                # gone
+                pass
+            self.map = None
+        self.fd.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self.offsets)
+        if not 0 <= i < len(self.offsets):
+            raise IndexError("capture index out of range")
+        p = self.offsets[i]
+        fc, count, interval, npackets = RECORD.unpack_from(self.map, p)
+        p += RECORD.size
+        packets = [PACKET.unpack_from(self.map, p + k * PACKET.size) for k in range(npackets)]
+        p += npackets * PACKET.size
+
+        data = []
+        for npulses, pcount in packets:
+            view = memoryview(self.map)[p:p + 4 * npulses]
+            if NATIVE and not self.copy:
+                pulses = view.cast("I")
+            else:
+                pulses = pulse_array()
+                pulses.frombytes(view)
+                view.release()
+                if not NATIVE:
+                    pulses.byteswap()
+            p += 4 * npulses
+            data.append(freeze_packet({"pulses": pulses, "count": pcount} if pcount != 1 else {"pulses": pulses}))
+
+        # Bypass _set_data, which would copy the pulses into arrays
+        code = RawCode(fc=fc, count=count, packet_interval=interval)
+        code.data = data
+        return code
+
+    def __iter__(self):
+        for i in range(len(self.offsets)):
+            yield self[i]
+
+class CaptureWriter(object):
+    """Appends captures to a capture archive, creating it if needed."""
+
+    def __init__(self, path):
+        if os.path.exists(path):
+            self.fd = open(path, "r+b")
+            header = self.fd.read(HEADER.size)
+            if len(header) < HEADER.size or HEADER.unpack(header)[0] != MAGIC:
+                raise DataError(f"Not a capture archive: {path!r}")
+            self.fd.seek(0, os.SEEK_END)
+            size = self.fd.tell()
+            with mmap.mmap(self.fd.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                self.offsets, end = _read_index(buf, size, copy=True)
+            # Drop the index (and any partial record), it is rewritten on close
+            self.fd.truncate(end)
+            self.fd.seek(end)
+        else:
+            self.fd = open(path, "w+b")
+            self.fd.write(HEADER.pack(MAGIC, VERSION, 0))
+            self.offsets = array("Q")
+
+    def append(self, code):
+        code = code.to_raw()
+        packets = [(pulse_array(i["pulses"]), i.get("count", 1)) for i in code.data]
+        # (anything else would read back as an invalid record)
+        if not code.fc or not packets or not all(len(pulses) for pulses, count in packets):
+            raise DataError("Cannot archive a code with no carrier frequency or pulses")
+        self.offsets.append(self.fd.tell())
+        parts = [RECORD.pack(code.fc, code.count, code.packet_interval, len(packets))]
+        parts += [PACKET.pack(len(pulses), count) for pulses, count in packets]
+        for pulses, count in packets:
+            if not NATIVE:
+                pulses = pulses[:]
+                pulses.byteswap()
+            parts.append(pulses.tobytes())
+        self.fd.write(b"".join(parts))
+
+    def close(self):
+        end = self.fd.tell()
+        if end % 8:
+            self.fd.write(bytes(8 - end % 8))
+        index_offset = self.fd.tell()
+        offsets = self.offsets
+        if not NATIVE:
+            offsets = offsets[:]
+            offsets.byteswap()
+        self.fd.write(offsets.tobytes())
+        self.fd.write(TRAILER.pack(index_offset, len(self.offsets), TRAILER_MAGIC))
+        self.fd.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
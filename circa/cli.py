@@ -1,7 +1,7 @@
 #!/usr/bin/python
 import json, sys, argparse, itertools
 
-from . import from_string, try_decode, find_format, find_device
+from . import from_string, try_decode, find_format, find_device, find_async_device, DecodeStats, CircaError
 
 def do_convert(args):
     code = from_string(args.code)
@@ -20,10 +20,56 @@ def do_simplify(args):
     code.simplify_params(args.threshold)
     print(code.to_string())
 
+def _decode_options(args):
+    return {"max_results": args.max_results, "min_score": args.min_score, "confident": args.confident}
+
+def _add_decode_options(parser):
+    parser.add_argument('-n', "--max-results", metavar="N", type=int, default=None, help="only output the N best guesses")
+    parser.add_argument('-m', "--min-score", metavar="SCORE", type=float, default=0.5, help="minimum guess score")
+    parser.add_argument("--confident", metavar="SCORE", type=float, default=None, help="stop at the first protocol decoding with at least this score")
+
 def do_decode(args):
     code = from_string(args.code)
-    for score, guess in try_decode(code):
+    stats = DecodeStats() if args.stats else None
+    for score, guess in try_decode(code, stats, **_decode_options(args)):
         print(f"{score * 100:.01f}% {guess}")
+    if stats is not None:
+        print(stats.format(), file=sys.stderr)
+
+def _batch_decode_one(line):
+    result = {"code": line}
+    try:
+        code = from_string(line)
+        result["guesses"] = [{"score": score, "code": guess.to_string()} for score, guess in try_decode(code)]
+    except Exception as e:
+        result["error"] = str(e)
+    return result
+
+def _pool_imap(pool, func, items, chunksize, unordered=False):
+    # Pool.imap() would read all of its input up front, so feed it in
+    # bounded batches to keep memory use flat.
+    imap = pool.imap_unordered if unordered else pool.imap
+    batch_size = chunksize * 64
+    while True:
+        batch = list(itertools.islice(items, batch_size))
+        if not batch:
+            break
+        yield from imap(func, batch, chunksize)
+
+def _batch_decode(args, infile):
+    import multiprocessing
+    lines = (line.strip() for line in infile)
+    lines = (line for line in lines if line and not line.startswith("#"))
+    with multiprocessing.Pool(args.jobs) as pool:
+        for result in _pool_imap(pool, _batch_decode_one, lines, args.chunksize, args.unordered):
+            print(json.dumps(result), flush=args.unordered)
+
+def do_batch_decode(args):
+    if args.input == "-":
+        _batch_decode(args, sys.stdin)
+    else:
+        with open(args.input, "r") as infile:
+            _batch_decode(args, infile)
 
 def do_transmit(args):
     code = from_string(args.code)
@@ -32,7 +78,22 @@ def do_transmit(args):
     dev.transmit(code)
 
 def do_receive(args):
-    devtype, params = args.device.split(":", 1)
+    archive = None
+    if args.archive is not None:
+        from .archive import CaptureWriter
+        archive = CaptureWriter(args.archive)
+    try:
+        if len(args.device) > 1:
+            import asyncio
+            asyncio.run(receive_many(args, archive))
+        else:
+            receive_single(args, archive)
+    finally:
+        if archive is not None:
+            archive.close()
+
+def receive_single(args, archive=None):
+    devtype, params = args.device[0].split(":", 1)
     dev = find_device(devtype)(params)
     if args.count == 0:
         it = itertools.count(start=1)
@@ -40,9 +101,110 @@ def do_receive(args):
         it = range(args.count)
     for i in it:
         code = dev.receive()
+        if code is None:
+            continue
+        if archive is not None:
+            archive.append(code)
         print("=== Received code ===")
-        for score, guess in try_decode(code):
+        stats = DecodeStats() if args.stats else None
+        for score, guess in try_decode(code, stats, **_decode_options(args)):
             print(f"{score * 100:.01f}% {guess}")
+        if stats is not None:
+            print(stats.format(), file=sys.stderr)
+
+async def receive_many(args, archive=None):
+    import asyncio, threading
+    loop = asyncio.get_running_loop()
+    archive_lock = threading.Lock()
+
+    def handle(code):
+        # Archiving and decoding are blocking and CPU bound, keep them off
+        # the event loop so the other devices are still read meanwhile
+        if archive is not None:
+            with archive_lock:
+                archive.append(code)
+        stats = DecodeStats() if args.stats else None
+        return try_decode(code, stats, **_decode_options(args)), stats
+
+    async def receive_one(spec):
+        devtype, params = spec.split(":", 1)
+        async with find_async_device(devtype)(params) as dev:
+            it = itertools.count(start=1) if args.count == 0 else range(args.count)
+            for i in it:
+                code = await dev.receive()
+                if code is None:
+                    continue
+                guesses, stats = await loop.run_in_executor(None, handle, code)
+                print(f"=== Received code from {spec} ===")
+                for score, guess in guesses:
+                    print(f"{score * 100:.01f}% {guess}")
+                if stats is not None:
+                    print(stats.format(), file=sys.stderr)
+
+    async def receive_or_report(spec):
+        # A failing device should not stop the others
+        try:
+            await receive_one(spec)
+        except Exception as e:
+            print(f"Error receiving from {spec}: {e}", file=sys.stderr)
+
+    await asyncio.gather(*(receive_or_report(spec) for spec in args.device))
+
+def do_add(args):
+    from .library import CodeLibrary
+    with CodeLibrary(args.library) as lib:
+        for s in args.code:
+            id = lib.add(from_string(s), name=args.name)
+            print(f"{id} {s}")
+
+def do_lookup(args):
+    from .library import CodeLibrary
+    code = from_string(args.code)
+    with CodeLibrary(args.library) as lib:
+        for score, id, name, stored, decoded in lib.lookup(code, args.k, args.min_score, args.protocol):
+            print(f"{score * 100:.01f}% #{id} {name or ''} {decoded or stored}")
+
+def _import_one(item):
+    path, name, code, fmt = item
+    result = {"file": path, "name": name}
+    try:
+        code = from_string(code)
+        if fmt is not None:
+            code = find_format(fmt).from_code(code)
+        result["code"] = code.to_string()
+    except Exception as e:
+        result["error"] = str(e)
+    return result
+
+def _import_items(args):
+    from .importers import find_files, read_file
+    for path, kind in find_files(args.path, args.type):
+        try:
+            for name, code in read_file(path, kind):
+                yield path, name, code.to_string(), args.format
+        except (CircaError, OSError) as e:
+            print(json.dumps({"file": path, "error": str(e)}), flush=True)
+
+def do_import(args):
+    import multiprocessing
+    if args.format is not None:
+        find_format(args.format)
+    items = _import_items(args)
+    with multiprocessing.Pool(args.jobs) as pool:
+        for result in _pool_imap(pool, _import_one, items, args.chunksize):
+            print(json.dumps(result))
+
+def do_bench(args):
+    from . import bench
+    bench.main(args)
+
+def do_serve(args):
+    import asyncio
+    from .server import serve
+    try:
+        asyncio.run(serve(args.socket, port=args.port))
+    except KeyboardInterrupt:
+        pass
 
 def main():
     parser = argparse.ArgumentParser(prog="PROG", description='IR code multitool')
@@ -63,19 +225,64 @@ def main():
     p_simplify.set_defaults(func=do_simplify)
 
     p_decode = subparsers.add_parser('decode', description="Automatically attempt to decode an IR code")
+    p_decode.add_argument("--stats", action="store_true", help="print per-stage timing statistics to stderr")
+    _add_decode_options(p_decode)
     p_decode.add_argument('code', metavar='TYPE:CODE', type=str, help='IR code to decode')
     p_decode.set_defaults(func=do_decode)
 
+    p_batch_decode = subparsers.add_parser('batch-decode', description="Decode many IR codes (one per line) in parallel, output as NDJSON")
+    p_batch_decode.add_argument('-j', "--jobs", metavar="JOBS", type=int, default=None, help="number of worker processes (default: CPU count)")
+    p_batch_decode.add_argument('-u', "--unordered", action="store_true", help="output results in completion order instead of input order")
+    p_batch_decode.add_argument("--chunksize", metavar="N", type=int, default=16, help="number of codes handed to a worker at a time")
+    p_batch_decode.add_argument('input', metavar='FILE', type=str, nargs="?", default="-", help='file with one TYPE:CODE per line (default: stdin)')
+    p_batch_decode.set_defaults(func=do_batch_decode)
+
     p_transmit = subparsers.add_parser('transmit', description="Transmit an IR code with a blaster")
     p_transmit.add_argument('device', metavar='TYPE:ARGS', type=str, help='Target device type/info')
     p_transmit.add_argument('code', metavar='TYPE:CODE', type=str, help='IR code to decode')
     p_transmit.set_defaults(func=do_transmit)
 
     p_receive = subparsers.add_parser('receive', description="Receive and decode an IR code with a blaster")
+    p_receive.add_argument("--stats", action="store_true", help="print per-stage decode timing statistics to stderr")
     p_receive.add_argument('-c', "--count", metavar="COUNT", type=int, default=1, help="number of codes to receive, use 0 for infinite")
-    p_receive.add_argument('device', metavar='TYPE:ARGS', type=str, help='Target device type/info')
+    _add_decode_options(p_receive)
+    p_receive.add_argument('-a', "--archive", metavar="FILE", type=str, default=None, help="also append the received codes to a capture archive")
+    p_receive.add_argument('device', metavar='TYPE:ARGS', type=str, nargs="+", help='Target device type/info (several devices are received from concurrently)')
     p_receive.set_defaults(func=do_receive)
 
+    p_add = subparsers.add_parser('add', description="Add IR codes to a code library")
+    p_add.add_argument('-l', "--library", metavar="FILE", type=str, required=True, help="code library (SQLite database)")
+    p_add.add_argument('-n', "--name", metavar="NAME", type=str, default=None, help="name to store with the codes")
+    p_add.add_argument('code', metavar='TYPE:CODE', type=str, nargs="+", help='IR codes to add')
+    p_add.set_defaults(func=do_add)
+
+    p_lookup = subparsers.add_parser('lookup', description="Find the closest matches for an IR code in a code library")
+    p_lookup.add_argument('-l', "--library", metavar="FILE", type=str, required=True, help="code library (SQLite database)")
+    p_lookup.add_argument('-k', metavar="K", type=int, default=5, help="maximum number of matches")
+    p_lookup.add_argument('-m', "--min-score", metavar="SCORE", type=float, default=0.5, help="minimum match score")
+    p_lookup.add_argument('-p', "--protocol", metavar="FORMAT", type=str, default=None, help="only match codes decoded as this format")
+    p_lookup.add_argument('code', metavar='TYPE:CODE', type=str, help='IR code to look up')
+    p_lookup.set_defaults(func=do_lookup)
+
+    p_import = subparsers.add_parser('import', description="Import codes from LIRC (lircd.conf), IRDB (.csv) and Flipper Zero (.ir) files, output as NDJSON")
+    p_import.add_argument('-f', "--format", metavar="FORMAT", type=str, default=None, help="convert codes to this format")
+    p_import.add_argument("--type", choices=["lirc", "irdb", "flipper"], default=None, help="file type (default: guess from file names, skipping unknown files)")
+    p_import.add_argument('-j', "--jobs", metavar="JOBS", type=int, default=None, help="number of worker processes (default: CPU count)")
+    p_import.add_argument("--chunksize", metavar="N", type=int, default=16, help="number of codes handed to a worker at a time")
+    p_import.add_argument('path', metavar='PATH', type=str, nargs="+", help='files or directories to import')
+    p_import.set_defaults(func=do_import)
+
+    p_bench = subparsers.add_parser('bench', description="Benchmark encoding, decoding and conversion for all formats, output as NDJSON")
+    p_bench.add_argument('-t', "--min-time", type=float, default=0.2, metavar="SECONDS", help="minimum time to spend on each measurement")
+    p_bench.add_argument('-o', "--output", metavar="FILE", type=str, default="-", help="output file (default: stdout)")
+    p_bench.set_defaults(func=do_bench)
+
+    p_serve = subparsers.add_parser('serve', description="Serve JSON convert/decode/transmit/receive requests, keeping device sessions open")
+    g_serve = p_serve.add_mutually_exclusive_group(required=True)
+    g_serve.add_argument('-s', "--socket", metavar="PATH", type=str, default=None, help="listen on a Unix socket")
+    g_serve.add_argument('-p', "--port", metavar="PORT", type=int, default=None, help="listen on a localhost TCP port")
+    p_serve.set_defaults(func=do_serve)
+
     args = parser.parse_args()
     if args.func is None:
         parser.help()
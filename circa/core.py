@@ -1,7 +1,11 @@
 #!/usr/bin/python
-import copy
+import copy, bisect, math
+from array import array
+from collections import Counter
 
-__all__ = ["CircaError", "ParseError", "DataError", "EncodeError", "DecodeError", "IRCode", "RawCode", "RawPmCode"]
+from .util import pulse_array, freeze_pulses, freeze_packet, RepeatedPulses
+
+__all__ = ["CircaError", "ParseError", "DataError", "EncodeError", "DecodeError", "PulseStats", "RunningStats", "Param", "IRCode", "RawCode", "RawPmCode", "StreamDecoder"]
 
 class CircaError(Exception):
     pass
@@ -18,7 +22,120 @@ class EncodeError(CircaError):
 class DecodeError(CircaError):
     pass
 
+class PulseStats(object):
+    """Cheap statistics over a flat pulse train, used to skip formats that
+    cannot plausibly decode it before attempting a full parse."""
+
+    def __init__(self, pulses):
+        self.count = len(pulses)
+        # Most protocols are built out of multiples of a short base time.
+        # Find the cluster of shortest pulses (ignoring a few runts) and
+        # take its median.
+        self.unit = 1
+        if pulses:
+            ordered = sorted(pulses)
+            base = ordered[len(ordered) // 10]
+            short = [i for i in ordered if i < base * 1.5]
+            self.unit = max(1, short[len(short) // 2])
+        self.mark_hist = Counter(int(round(i / self.unit)) for i in pulses[::2])
+        self.space_hist = Counter(int(round(i / self.unit)) for i in pulses[1::2])
+        self.preamble_ratio = pulses[0] / self.unit if pulses else 0
+
+        # Fraction of data marks that are about one unit long (pulse-distance
+        # coding), with some slack for jitter. Long marks (headers, which
+        # dominate codes made of many short repeat frames) are left out.
+        marks = sorted(pulses[::2])
+        limit = 2 * marks[len(marks) // 2] if marks else 0
+        data_marks = sum(n for k, n in self.mark_hist.items() if k * self.unit <= limit)
+        short_marks = min(data_marks, bisect.bisect_left(marks, 1.75 * self.unit))
+        self.distance = short_marks / data_marks if data_marks else 0
+        # Fraction of pulses that are one or two units long (Manchester coding)
+        short = sum(h[1] + h[2] for h in (self.mark_hist, self.space_hist))
+        self.manchester = short / self.count if self.count else 0
+
+class RunningStats(object):
+    """Running count, mean and variance of a series of measurements.
+
+    The sums are kept exactly (for integer samples), so the results are the
+    same as computing them over the whole list of samples.
+    """
+
+    def __init__(self, samples=()):
+        self.count = 0
+        self.total = 0
+        self.sumsq = 0
+        for v in samples:
+            self.add(v)
+
+    def add(self, v):
+        self.count += 1
+        self.total += v
+        self.sumsq += v * v
+
+    def copy(self):
+        new = RunningStats()
+        new.count, new.total, new.sumsq = self.count, self.total, self.sumsq
+        return new
+
+    @property
+    def mean(self):
+        return self.total / self.count
+
+    @property
+    def value(self):
+        # Param estimate
+        return int(round(self.total / self.count))
+
+    @property
+    def variance(self):
+        # Sample variance, like statistics.variance()
+        n = self.count
+        if n < 2:
+            return 0.0
+        if isinstance(self.total, int) and isinstance(self.sumsq, int):
+            # (int true division is correctly rounded)
+            return (n * self.sumsq - self.total ** 2) / (n * (n - 1))
+        return max(0.0, (self.sumsq - self.total ** 2 / n) / (n - 1))
+
+    @property
+    def stdev(self):
+        return math.sqrt(self.variance)
+
+    @property
+    def spread(self):
+        # Standard deviation relative to the mean, 0 for a single sample
+        return self.stdev / abs(self.mean) if self.total else 0.0
+
+class Param(object):
+    """A format parameter: long and short (string form) names, validator, and
+    default. A callable default is evaluated on the code, for defaults that
+    depend on earlier params."""
+    __slots__ = ("name", "short", "validate", "default", "dynamic")
+
+    def __init__(self, name, short, validate, default):
+        self.name = name
+        self.short = short
+        self.validate = validate
+        self.default = default
+        self.dynamic = callable(default)
+
+    def default_for(self, code):
+        return self.default(code) if self.dynamic else self.default
+
 class IRCode(object):
+    # Formats that can hold any pulse train, as opposed to a protocol
+    RAW = False
+
+    # Params are declared per class, in string form order. Instances keep
+    # them (and everything else) in slots, so subclasses must declare
+    # __slots__ for any attributes they add.
+    PARAMS = (
+        Param("fc", "f", int, 38000),
+        Param("count", "c", int, 1),
+        Param("packet_interval", "pi", int, 0),
+    )
+    __slots__ = ("data", "_raw", "_flat", "_samples", "fc", "count", "packet_interval")
+
     def __init__(self, data=None, **kwargs):
         self._set_params(kwargs)
         if data is None:
@@ -60,12 +177,17 @@ class IRCode(object):
             return code.clone()
         obj = cls()
         obj.parse_code(code)
+        obj._invalidate()
         return obj
 
     @classmethod
     def parse_code(cls, code):
         raise NotImplementedError()
 
+    @classmethod
+    def accepts(cls, stats):
+        return True
+
     @classmethod
     def from_struct(cls, struct):
         self = cls()
@@ -91,12 +213,17 @@ class IRCode(object):
         return self
 
     def _clone_from(self, other, data=True):
+        self._invalidate()
         if data:
-            self.data = copy.deepcopy(other.data)
+            self.data = self._copy_data(other.data)
         else:
             self.data = None
-        for lname, sname, validate, default in other.params():
-            setattr(self, lname, getattr(other, lname))
+        for param in other.PARAMS:
+            setattr(self, param.name, getattr(other, param.name))
+
+    def _copy_data(self, data):
+        # Protocol packets are small, copy them
+        return copy.deepcopy(data)
 
     def clone(self, data=True):
         cls = type(self)
@@ -111,29 +238,47 @@ class IRCode(object):
         raise NotImplementedError()
 
     def _set_params(self, values={}, short=False):
+        self._invalidate()
         values = dict(values)
-        for lname, sname, validate, default in self.params():
-            name = sname if short else lname
-            setattr(self, lname, validate(values.pop(name, default)))
+        for param in self.PARAMS:
+            name = param.short if short else param.name
+            value = values.pop(name) if name in values else param.default_for(self)
+            setattr(self, param.name, param.validate(value))
 
         if values:
             raise DataError(f"Unknown options: {list(values.keys())!r}")
 
     def _set_data(self, data):
+        self._invalidate()
         self.data = [self._parse_packet(packet) for packet in data]
 
     def _format_packet(self, packet):
         pass
 
     def params(self):
-        yield ("fc", "f", int, 38000)
-        yield ("count", "c", int, 1)
-        yield ("packet_interval", "pi", int, 0)
+        # (lname, sname, validate, default) for each param
+        for param in self.PARAMS:
+            yield param.name, param.short, param.validate, param.default_for(self)
+
+    def _invalidate(self):
+        # Cached encodings are only valid as long as params and data do not
+        # change. Anything that modifies them must call this.
+        self._raw = None
+        self._flat = {}
 
     def to_raw(self, state=None):
+        # Encoding with state (e.g. RC5 toggle bits) is not repeatable
+        if state is not None:
+            return self._to_raw(state)
+        if self._raw is None:
+            self._raw = self._to_raw()
+        return self._raw
+
+    def _to_raw(self, state=None):
         raw_data = []
         for packet in self.data:
             count, pulses = self.encode_packet(packet, state)
+            pulses = pulse_array(pulses)
             if self.count > 1 or len(self.data) > 1:
                 pulses[-1] += max(0, self.packet_interval - sum(pulses))
             raw_data.append({"count": count, "pulses": pulses})
@@ -146,10 +291,10 @@ class IRCode(object):
     def to_string_parts(self):
         name = self.NAMES[0]
         params = []
-        for lname, sname, validate, default in self.params():
-            val = getattr(self, lname)
-            if val != default:
-                params.append(f"{sname}={val}")
+        for param in self.PARAMS:
+            val = getattr(self, param.name)
+            if val != param.default_for(self):
+                params.append(f"{param.short}={val}")
         data = ";".join(self._format_one_string_data(i) for i in self.data)
         return name, ','.join(params), data
 
@@ -162,10 +307,10 @@ class IRCode(object):
 
     def to_struct(self, full=False):
         struct = {"format": self.NAMES[0]}
-        for lname, sname, validate, default in self.params():
-            val = getattr(self, lname)
-            if val != default or full:
-                struct[lname] = val
+        for param in self.PARAMS:
+            val = getattr(self, param.name)
+            if full or val != param.default_for(self):
+                struct[param.name] = val
         struct["data"] = self.data
         return struct
 
@@ -173,43 +318,80 @@ class IRCode(object):
         self._samples = {}
 
     def _sample(self, k, v):
-        samples = self._samples.setdefault(k, [])
-        samples.append(v)
-        setattr(self, k, int(round(sum(samples) / len(samples))))
+        stats = self._samples.get(k)
+        if stats is None:
+            stats = self._samples[k] = RunningStats()
+        stats.add(v)
+        setattr(self, k, stats.value)
+
+    def _set_samples(self, samples):
+        self._samples = {k: v.copy() for k, v in samples.items()}
+        for k, v in self._samples.items():
+            setattr(self, k, v.value)
+
+    def param_stats(self):
+        """Return the RunningStats of each param that was measured when this
+        code was parsed from another code, e.g. to judge how consistent the
+        timings were (their spread)."""
+        return dict(getattr(self, "_samples", {}))
 
     def _sample_default(self, k, v):
         if k not in self._samples:
             setattr(self, k, v)
 
+    def simplified_params(self, tolerance=0.2):
+        """Return the params simplify_params(tolerance) would change, and their
+        new values, without changing this code."""
+        # Defaults can depend on earlier params, so walk them on a shallow copy
+        shadow = copy.copy(self)
+        changes = {}
+        for param in self.PARAMS:
+            val = getattr(shadow, param.name)
+            default = param.default_for(shadow)
+            if val != default and default * (1 - tolerance) <= val <= default * (1 + tolerance):
+                setattr(shadow, param.name, default)
+                changes[param.name] = default
+        return changes
+
     def simplify_params(self, tolerance=0.2):
-        for lname, sname, validate, default in self.params():
-            val = getattr(self, lname)
-            if default * (1 - tolerance) <= val <= default * (1 + tolerance):
-                setattr(self, lname, default)
+        self._invalidate()
+        for lname, default in self.simplified_params(tolerance).items():
+            setattr(self, lname, default)
 
     def __str__(self):
         return self.to_string()
 
 class RawCode(IRCode):
     NAMES = ["raw"]
+    RAW = True
+    __slots__ = ("_scan",)
 
     def _set_data(self, data):
         assert data is not None
+        self._invalidate()
 
-        if isinstance(data, list) and isinstance(data[0], int):
+        if isinstance(data, array) or isinstance(data, list) and isinstance(data[0], int):
             # single string of data
-            self.data = [{"pulses": data}]
-        else:
-            self.data = data
-        for packet in self.data:
+            data = [{"pulses": data}]
+        self.data = []
+        for packet in data:
             for key in packet:
                 if key not in ("pulses", "count"):
                     raise DataError(f"Unsupported key: {key!r}")
             if "pulses" not in packet:
                 raise DataError(f"IR packet with no pulses: {packet!r}")
-            v = packet["pulses"]
+            try:
+                v = freeze_pulses(packet["pulses"])
+            except (TypeError, OverflowError):
+                raise DataError(f"IR pulse data must be non-negative integers: {packet!r}")
             if len(v) % 2 != 0:
                 raise DataError(f"IR pulse data length not a multiple of 2: {packet!r}")
+            self.data.append(freeze_packet({**packet, "pulses": v}))
+
+    def _copy_data(self, data):
+        # Packets (and their pulses) are frozen, so clones can share them.
+        # Changes go through copies (see adjust_pulse).
+        return list(data)
 
     def _parse_string_data(self, data):
         l = [self._parse_one_string_data(i) for i in data.split(";")]
@@ -238,40 +420,157 @@ class RawCode(IRCode):
         self._clone_from(code.to_raw())
         return self
 
+    def to_struct(self, full=False):
+        struct = super().to_struct(full)
+        struct["data"] = [{**packet, "pulses": list(packet["pulses"])} for packet in self.data]
+        return struct
+
     def to_raw(self, state=None):
         return self
 
-    def flatten(self, no_repeats=True):
+    def adjust_pulse(self, packet, index, delta):
+        """Return a copy of this code with one pulse lengthened by `delta`
+        (shortened if negative). Other packets are shared with this code."""
+        new = self.clone()
+        pulses = pulse_array(new.data[packet]["pulses"])[:]
+        pulses[index] = max(0, pulses[index] + delta)
+        new.data[packet] = freeze_packet({**new.data[packet], "pulses": pulses})
+        return new
+
+    def fingerprint(self):
+        """Hash of the quantized pulse train, stable under small timing jitter.
+
+        Pulses are bucketed by their ratio to the median pulse, with bucket
+        edges placed between the usual multiples (1x, 2x, 3-4x, 8x, 16x).
+        Very long pulses (and the final pulse) become frame gaps. Runs of
+        identical frames are collapsed into one, so the number of repeats
+        does not matter.
+        """
+        import hashlib
+        edges = (0.5, 1.5, 2.5, 5.66, 11.3, 22.6, 32)
+        pulses = self.flatten(lazy=True).data[0]["pulses"]
+        median = sorted(pulses)[len(pulses) // 2] or 1
+
+        frames = []
+        frame = []
+        for i, pulse in enumerate(pulses):
+            bucket = bisect.bisect(edges, pulse / median)
+            if bucket == len(edges) or i == len(pulses) - 1:
+                frame.append("G")
+                frame = ",".join(frame)
+                if not frames or frames[-1] != frame:
+                    frames.append(frame)
+                frame = []
+            else:
+                frame.append("%d" % bucket)
+
+        return hashlib.blake2b(";".join(frames).encode("ascii"), digest_size=8).hexdigest()
+
+    def flatten(self, no_repeats=True, lazy=False):
+        # The result is cached and shared, callers must not modify it.
+        # With lazy=True, the pulses are a read-only RepeatedPulses view
+        # instead of a fully expanded array.
+        flat = self._flat.get((no_repeats, lazy))
+        if flat is None:
+            flat = self._flat[(no_repeats, lazy)] = self._flatten(no_repeats, lazy)
+        return flat
+
+    def _flatten(self, no_repeats, lazy):
+        flat = self.clone(data=False)
         if len(self.data) == 1:
-            flat = self.clone(data=True)
-            if "count" in flat.data[0]:
-                flat.count *= flat.data[0]["count"]
-                del flat.data[0]["count"]
+            flat.count *= self.data[0].get("count", 1)
+            segments = [(self.data[0]["pulses"], 1)]
         else:
-            flat = self.clone(data=False)
-            pulses = []
-            for i in self.data:
-                count = i.get("count", 1)
-                pulses += count * i["pulses"]
-            flat.data = [{"pulses": pulses}]
-
-        length = sum(flat.data[0]["pulses"])
+            segments = [(i["pulses"], i.get("count", 1)) for i in self.data]
+
+        length = sum(sum(pulses) * count for pulses, count in segments)
         if flat.count > 1 and length < flat.packet_interval:
-            flat.data[0]["pulses"][-1] += flat.packet_interval - length
+            pulses, count = segments.pop()
+            if count > 1:
+                segments.append((pulses, count - 1))
+            pulses = pulse_array(pulses)[:]
+            pulses[-1] += flat.packet_interval - length
+            segments.append((pulses, 1))
 
         if no_repeats and flat.count > 1:
-            flat.data[0]["pulses"] *= flat.count
+            pulses = RepeatedPulses(segments, flat.count)
             flat.count = 1
+        else:
+            pulses = RepeatedPulses(segments)
 
+        flat.data = [freeze_packet({"pulses": pulses if lazy else pulses.to_array()})]
         flat.packet_interval = 0
 
         return flat
 
 class RawPmCode(RawCode):
     NAMES = ["rawpm"]
+    __slots__ = ()
 
     def _format_one_string_data(self, d):
         s = ",".join(str(int(j * (1 - 2 * (i % 2)))) for i, j in enumerate(d["pulses"]))
         if "count" in d and d["count"] != 1:
             s = "%d/" % d["count"] + s
         return s
+
+class StreamDecoder(object):
+    """Push-style decoder for a live pulse stream.
+
+    Pulses (alternating mark/space, starting with a mark) are passed to
+    feed() as they arrive. The stream is split into frames on spaces of at
+    least `gap` us, and each frame is decoded as soon as it completes, so
+    only the current frame is ever buffered. feed() and flush() return a
+    list of (kind, code) events, where kind is "packet" or "repeat".
+    """
+    # Frames longer than this are assumed to be noise and discarded
+    MAX_FRAME = 4096
+
+    def __init__(self, gap, fc=38000):
+        self.gap = gap
+        self.fc = fc
+        self.last = None
+        self._frame = []
+        self._overflow = False
+
+    def feed(self, pulses):
+        events = []
+        for pulse in pulses:
+            self._frame.append(pulse)
+            if len(self._frame) % 2 == 0 and pulse >= self.gap:
+                if self._overflow:
+                    self._overflow = False
+                    self._frame = []
+                else:
+                    events += self._end_frame()
+            elif len(self._frame) > self.MAX_FRAME:
+                # Drop the frame up to its gap, keeping track of whether the
+                # next pulse is a mark or a space
+                self._overflow = True
+                del self._frame[:len(self._frame) & ~1]
+        return events
+
+    def flush(self):
+        if self._overflow:
+            self._frame = []
+            self._overflow = False
+            return []
+        if len(self._frame) % 2:
+            self._frame.append(self.gap)
+        return self._end_frame()
+
+    def reset(self):
+        self.last = None
+        self._frame = []
+        self._overflow = False
+
+    def _end_frame(self):
+        frame, self._frame = self._frame, []
+        if not frame:
+            return []
+        try:
+            return self.decode_frame(RawCode(frame, fc=self.fc))
+        except CircaError:
+            return []
+
+    def decode_frame(self, frame):
+        raise NotImplementedError()
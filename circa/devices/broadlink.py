@@ -1,47 +1,131 @@
 #!/usr/bin/python
-import time, base64
+import time, asyncio
 
 try:
     import broadlink
-    from broadlink.exceptions import ReadError, StorageError
+    from broadlink.exceptions import (ReadError, StorageError, AuthenticationError, AuthorizationError,
+                                      ConnectionClosedError, DeviceOfflineError, NetworkTimeoutError)
+    # Errors after which the session is re-established and the command retried
+    RECONNECT_ERRORS = (OSError, AuthenticationError, AuthorizationError, ConnectionClosedError,
+                        DeviceOfflineError, NetworkTimeoutError)
 except ImportError:
     broadlink = None
 
 from ..core import *
 from ..formats.broadlink import BroadlinkCode
 
-__all__ = ["BroadlinkDevice"]
+__all__ = ["BroadlinkDevice", "AsyncBroadlinkDevice"]
 
 class BroadlinkDevice(object):
     NAMES = ["broadlink"]
-    def __init__(self, args):
+    TIMEOUT = 60
+    # Learning mode is polled quickly at first, then backs off to POLL_MAX
+    POLL_MIN = 0.05
+    POLL_MAX = 1.0
+
+    def __init__(self, args, connect=True):
         if not broadlink:
             raise Exception("broadlink module not available")
         devtype, host, mac = args.split(":")
-        devtype = int(devtype, 0)
-        mac = bytearray.fromhex(mac)
+        self.devtype = int(devtype, 0)
+        self.host = host
+        self.mac = bytearray.fromhex(mac)
+        self.dev = None
+        if connect:
+            self.connect()
+
+    def connect(self):
+        dev = broadlink.gendevice(self.devtype, (self.host, 80), self.mac)
+        dev.auth()
+        self.dev = dev
 
-        self.dev = broadlink.gendevice(devtype, (host, 80), mac)
-        self.dev.auth()
+    def _poll_intervals(self):
+        interval = self.POLL_MIN
+        while True:
+            yield interval
+            interval = min(interval * 1.5, self.POLL_MAX)
+
+    def _check_data(self):
+        try:
+            data = self.dev.check_data()
+        except (ReadError, StorageError):
+            return None
+        # The first pulse usually ends up short by about this much
+        return BroadlinkCode(data).to_raw().adjust_pulse(0, 0, 128)
 
     def receive(self):
         self.dev.enter_learning()
-        TIMEOUT = 60
-        start = time.time()
-        while time.time() - start < TIMEOUT:
-            time.sleep(1)
-            try:
-                data = self.dev.check_data()
-            except (ReadError, StorageError):
-                continue
-            code = BroadlinkCode(data).to_raw()
-            # The first pulse usually ends up short by about this much
-            code.data[0]["pulses"][0] += 128
-            return code
+        start = time.monotonic()
+        for interval in self._poll_intervals():
+            if time.monotonic() - start >= self.TIMEOUT:
+                break
+            time.sleep(interval)
+            code = self._check_data()
+            if code is not None:
+                return code
         return None
 
-    def transmit(self, code):
+    def _send(self, code):
         if not isinstance(code, BroadlinkCode):
-            data = BroadlinkCode.from_code(code)
-        for packet in data.data:
-            self.dev.send_data(base64.b64decode(packet))
+            code = BroadlinkCode.from_code(code)
+        for packet in code.data:
+            self.dev.send_data(packet)
+
+    def transmit(self, code):
+        self._send(code)
+
+class AsyncBroadlinkDevice(BroadlinkDevice):
+    """asyncio interface to a Broadlink device.
+
+    The blocking library calls run in worker threads, so any number of
+    devices can be driven from one event loop. The session is kept
+    authenticated across calls and is re-established (with one retry of the
+    failed command) if the device stops responding.
+    """
+
+    def __init__(self, args):
+        super().__init__(args, connect=False)
+        self._lock = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def open(self):
+        await self._call(lambda: None)
+
+    async def close(self):
+        self.dev = None
+
+    async def _call(self, fn, *args):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            for attempt in range(2):
+                try:
+                    if self.dev is None:
+                        await asyncio.to_thread(self.connect)
+                    return await asyncio.to_thread(fn, *args)
+                except RECONNECT_ERRORS:
+                    self.dev = None
+                    if attempt:
+                        raise
+
+    async def receive(self, timeout=None):
+        timeout = self.TIMEOUT if timeout is None else timeout
+        await self._call(lambda: self.dev.enter_learning())
+        start = time.monotonic()
+        for interval in self._poll_intervals():
+            if time.monotonic() - start >= timeout:
+                break
+            await asyncio.sleep(interval)
+            code = await self._call(self._check_data)
+            if code is not None:
+                return code
+        return None
+
+    async def transmit(self, code):
+        await self._call(self._send, code)
@@ -3,12 +3,13 @@
 import base64
 
 from ..core import *
-from ..util import scale_pulses
+from ..util import scale_pulses, pulse_array
 
 __all__ = ["BroadlinkCode", "BroadlinkHexCode"]
 
 class BroadlinkCode(IRCode):
     NAMES = ["broadlink", "b64"]
+    RAW = True
     CLOCK = 32768
 
     def __init__(self, data=None, **kwargs):
@@ -17,65 +18,78 @@ class BroadlinkCode(IRCode):
         self.count = 1
         self.packet_interval = 0
 
-    def params(self):
-        yield from ()
+    PARAMS = ()
+    __slots__ = ()
 
     def _set_data(self, data):
-        if isinstance(data, str) or isinstance(data, bytes):
+        if isinstance(data, (str, bytes, bytearray, memoryview)):
             data = [data]
         super()._set_data(data)
 
+    # Packets are kept as the binary blobs the device uses, and only
+    # converted to base64 (or hex) at the string/struct boundary.
     def _parse_packet(self, packet):
-        if isinstance(packet, bytes):
-            packet = base64.b64encode(packet).decode("ascii")
-        else:
-            try:
-                base64.b64decode(packet)
-            except:
-                raise DataError(f"Invalid base64 data: {packet!r}")
-        return packet
+        if isinstance(packet, (bytes, bytearray, memoryview)):
+            return bytes(packet)
+        try:
+            return base64.b64decode(packet)
+        except:
+            raise DataError(f"Invalid base64 data: {packet!r}")
 
     def _parse_one_string_data(self, s):
         try:
-            base64.b64decode(s)
+            return base64.b64decode(s)
         except:
             raise ParseError(f"Invalid base64 data: {s!r}")
-        return s
+
+    def to_struct(self, full=False):
+        struct = super().to_struct(full)
+        struct["data"] = [base64.b64encode(packet).decode("ascii") for packet in self.data]
+        return struct
 
     def parse_code(self, code):
-        code = code.to_raw().flatten(no_repeats=False)
+        code = code.to_raw().flatten(no_repeats=False, lazy=True)
 
         pulses = scale_pulses(code.data[0]["pulses"], 1000000, self.CLOCK)
 
         if code.count > 256:
             raise DecodeError(f"Broadlink format only supports up to 256 repeats (got: {code.count})")
 
-        packet = []
-        for pulse in pulses:
-            if pulse < 1:
-                raise DecodeError("Pulse length < 1")
-            elif pulse > 0xffff:
-                raise DecodeError(f"Pulse length too long: {pulse}")
-            elif pulse > 255:
-                packet += [0, pulse >> 8, pulse & 0xff]
-            else:
-                packet.append(pulse)
+        if pulses and (min(pulses) < 1 or max(pulses) > 0xffff):
+            for pulse in pulses:
+                if pulse < 1:
+                    raise DecodeError("Pulse length < 1")
+                elif pulse > 0xffff:
+                    raise DecodeError(f"Pulse length too long: {pulse}")
+
+        if not pulses:
+            payload = b""
+        elif max(pulses) <= 255:
+            # (not bytes(pulses): that would copy the uint32 buffer)
+            payload = bytes(list(pulses))
+        else:
+            payload = bytearray()
+            for pulse in pulses:
+                if pulse > 255:
+                    payload += bytes((0, pulse >> 8, pulse & 0xff))
+                else:
+                    payload.append(pulse)
 
-        if len(packet) > 0xffff:
-            raise DecodeError(f"Packet is too long: {len(packet)} bytes")
+        if len(payload) > 0xffff:
+            raise DecodeError(f"Packet is too long: {len(payload)} bytes")
 
-        packet = [0x26, code.count - 1, len(packet) & 0xff, len(packet) >> 8, *packet]
+        packet = bytes((0x26, code.count - 1, len(payload) & 0xff, len(payload) >> 8)) + payload
 
         if len(packet) % 16 != 0:
             packet += bytes(16 - (len(packet) % 16))
 
-        self.data = [base64.b64encode(bytes(packet)).decode("ascii")]
+        self.data = [packet]
 
     def _format_one_string_data(self, d):
-        return d
+        return base64.b64encode(d).decode("ascii")
 
     def encode_packet(self, packet, state=None):
-        data = base64.b64decode(packet)
+        data = packet
         if data[0] != 0x26:
             raise EncodeError(f"Packet header is not 0x26: 0x{data[0]:02x}")
 
@@ -84,17 +98,22 @@ class BroadlinkCode(IRCode):
         if length > (len(data) - 4):
             raise EncodeError("Packet is too short")
 
-        data = data[4:4+length]
+        data = memoryview(data)[4:4+length]
 
+        # Copy runs of single-byte pulses in bulk, and expand the 0x00
+        # escapes (followed by a big-endian 16-bit pulse) between them.
+        pulses = pulse_array()
         p = 0
-        pulses = []
         while p < length:
-            pulse = data[p]
-            p += 1
-            if pulse == 0:
-                pulse = (data[p] << 8) | data[p + 1]
-                p += 2
-            pulses.append(pulse)
+            z = packet.find(0, 4 + p, 4 + length) - 4
+            if z < 0:
+                pulses.extend(data[p:])
+                break
+            pulses.extend(data[p:z])
+            if z + 2 >= length:
+                raise EncodeError("Truncated long pulse")
+            pulses.append((data[z + 1] << 8) | data[z + 2])
+            p = z + 3
 
         pulses = scale_pulses(pulses, self.CLOCK, 1000000)
 
@@ -102,12 +121,13 @@ class BroadlinkCode(IRCode):
 
 class BroadlinkHexCode(BroadlinkCode):
     NAMES = ["broadlink-hex"]
+    __slots__ = ()
 
     def _parse_one_string_data(self, s):
         try:
-            return base64.b64encode(bytes.fromhex(s)).decode("ascii")
+            return bytes.fromhex(s)
         except:
             raise ParseError(f"Invalid hex data: {s!r}")
 
     def _format_one_string_data(self, d):
-        return base64.b64decode(d).hex()
+        return d.hex()
@@ -0,0 +1,331 @@
+#!/usr/bin/python
+
+from ..core import *
+
+__all__ = ["ScanResult", "PulseDistanceTable", "ManchesterTable", "TABLES", "register", "scan", "scan_code"]
+
+class ScanResult(object):
+    """Frames and timing samples a table extracted from a pulse train.
+
+    `frames` holds the bits of each data frame, `repeats` the number of
+    repeat frames after them, and `samples` the timing measurements, keyed
+    by the format parameter they estimate (as RunningStats).
+    """
+
+    def __init__(self):
+        self.frames = []
+        self.repeats = 0
+        self.burst_count = 0
+        self.samples = {}
+
+    def sample(self, k, v):
+        stats = self.samples.get(k)
+        if stats is None:
+            stats = self.samples[k] = RunningStats()
+        stats.add(v)
+
+class Matcher(object):
+    # Consumes (mark, space) pairs for one table, raises DataError on mismatch
+    def __init__(self, table):
+        self.table = table
+        self.result = ScanResult()
+
+    def feed(self, mark, space):
+        raise NotImplementedError()
+
+    def finish(self):
+        raise NotImplementedError()
+
+class PulseDistanceMatcher(Matcher):
+    def __init__(self, table):
+        super().__init__(table)
+        self.state = "start"
+        self.started = False
+        self.pending = []
+        self.prev_space = None
+        self.frame_length = 0
+        self.last_frame_length = None
+
+    @property
+    def unit(self):
+        stats = self.result.samples.get("pulse_time")
+        return self.table.unit if stats is None else stats.value
+
+    def feed(self, mark, space):
+        if self.state == "start":
+            # Burst detection needs to look at the first two pairs
+            self.pending.append((mark, space))
+            if len(self.pending) == 2:
+                self._start()
+            return
+        self._process(mark, space)
+
+    def _start(self):
+        pending, self.pending = self.pending, []
+        self.state = "header"
+        if self.table.burst and len(pending) == 2:
+            pulses = [*pending[0], *pending[1]]
+            bmin = min(pulses[1:4])
+            bmax = max(pulses[:4])
+            self.bavg = sum(pulses[:4]) / 4
+            if pulses[0] < self.bavg * 1.5 and abs(bmin - self.bavg) / self.bavg < 0.3 and (bmax - self.bavg) / self.bavg < 0.3:
+                self.state = "burst"
+        for mark, space in pending:
+            self._process(mark, space)
+
+    def _process(self, mark, space):
+        r = self.result
+        if self.state == "burst":
+            if mark > 2 * self.bavg:
+                r.sample("burst_gap", self.prev_space)
+                self.state = "header"
+            else:
+                r.sample("burst_time_high", mark)
+                r.burst_count += 1
+                if space > 2 * self.bavg:
+                    r.sample("burst_gap", space)
+                    self.state = "header"
+                else:
+                    r.sample("burst_time_low", space)
+                self.prev_space = space
+                return
+
+        if self.state == "header":
+            self.started = True
+            self.header = mark, space
+            self.header_gap = self.prev_space
+            self.bits = []
+            self.frame_pairs = 0
+            self.frame_length = mark + space
+            self.state = "bits"
+            self.prev_space = space
+            return
+
+        # state == "bits"
+        if self.frame_pairs == 0 and r.frames and not r.repeats:
+            r.sample("packet_gap", self.header_gap)
+        if (self.bits or r.frames) and mark > self.unit * self.table.mark_max:
+            self.frame_pairs += 1
+            self._end_frame()
+            self.state = "header"
+            self._process(mark, space)
+            return
+
+        self.frame_pairs += 1
+        self.frame_length += mark + space
+        self.prev_space = space
+        r.sample("pulse_time", mark)
+        if space < self.unit * self.table.zero_max:
+            self.bits.append(0)
+            r.sample("space_time_0", space)
+        elif space < self.unit * self.table.one_max:
+            self.bits.append(1)
+            r.sample("space_time_1", space)
+        else:
+            self.bits.append(0) # end bit?
+            self._end_frame()
+            self.state = "header"
+
+    def _end_frame(self):
+        r = self.result
+        bits = self.bits
+        hh, hl = self.header
+        if (len(bits) % 8) != 1:
+            raise DataError("Bit count not an even number of bytes")
+
+        if len(bits) > 1:
+            r.sample("preamble_time_high", hh)
+            r.sample("preamble_time_low", hl)
+            if r.repeats > 0:
+                raise DataError("Data packet after a repeat packet")
+            r.frames.append(bits[:-1])
+            if self.last_frame_length:
+                r.sample("packet_interval", self.last_frame_length)
+        else:
+            r.sample("repeat_time_high", hh)
+            r.sample("repeat_time_low", hl)
+            if not r.frames:
+                raise DataError("Repeat packet with no data packet")
+            if r.repeats > 0:
+                r.sample("repeat_interval", self.last_frame_length)
+            else:
+                r.sample("packet_interval", self.last_frame_length)
+            r.repeats += 1
+
+        self.last_frame_length = self.frame_length
+
+    def finish(self):
+        if self.state == "start":
+            self._start()
+        if not self.started:
+            raise DataError("No data")
+        if self.state == "bits":
+            if self.frame_pairs == 0:
+                # runt end pulse?
+                if not self.result.frames:
+                    raise DataError("No data")
+            else:
+                self._end_frame()
+        return self.result
+
+class ManchesterMatcher(Matcher):
+    # Manchester codes have no reliable framing until the whole train has
+    # been seen, so this only buffers during the scan.
+    def __init__(self, table):
+        super().__init__(table)
+        self.pulses = []
+
+    def feed(self, mark, space):
+        self.pulses += (mark, space)
+
+    def finish(self):
+        t = self.table
+        r = self.result
+        pulses = self.pulses
+        if not pulses:
+            raise DataError("No data")
+
+        # a space longer than 4 of the longest marks means a new packet
+        pause = max(pulses[::2]) * 4
+
+        p = 0
+        last_frame_length = None
+        while p < (len(pulses)-1):
+            frame_start = p
+            while p < (len(pulses)-1):
+                mark, space = pulses[p:p + 2]
+                p += 2
+                if space > pause:
+                    break
+
+            times = sorted(pulses[frame_start:p - 1])
+
+            if len(times) < t.min_pulses:
+                raise DataError("Packet too short")
+            if len(times) > t.max_pulses:
+                raise DataError("Packet too long")
+
+            # Ignore the shortest pulse and longest pulse, in case of noise
+            min_time = min(times[1:])
+            max_time = max(times[:-1])
+
+            # If there isn't enough difference between the pulse times, we might have a special
+            # case of 10101010101010 or 11111111111111 or off by one bit
+            th = (min_time + max_time) / 2
+            if (max_time / min_time) < 1.3:
+                if len(times) <= t.min_pulses + 2:
+                    th = th * 0.75
+                elif len(times) >= t.max_pulses - 4:
+                    th = th * 1.5
+
+            bits = [t.start_bit]
+            skip = False
+            for pulse in pulses[frame_start:p - 1]:
+                if pulse > th:
+                    if skip:
+                        raise DataError("Invalid Manchester encoding")
+                    r.sample("bit_time", pulse / 2)
+                    bits.append(bits[-1] ^ 1)
+                else:
+                    r.sample("bit_time", pulse)
+                    if skip:
+                        skip = False
+                    else:
+                        bits.append(bits[-1])
+                        skip = True
+
+            # Allow some garbage at the end
+            if not t.bits <= len(bits) <= t.bits + t.extra_bits:
+                raise DataError(f"Packet length invalid: {len(bits)}")
+
+            r.frames.append(bits[:t.bits])
+
+            if last_frame_length:
+                r.sample("packet_interval", last_frame_length)
+            last_frame_length = sum(pulses[frame_start:p])
+
+        return r
+
+class PulseDistanceTable(object):
+    """Pulse-distance coding (NEC style): a header, then one constant-width
+    mark per bit, with the bit value in the following space, and a stop bit.
+
+    Thresholds are in multiples of the pulse time, which starts at `unit`
+    and follows the measured marks. An optional leading burst of short
+    pulses is recognized and measured.
+    """
+    matcher = PulseDistanceMatcher
+
+    def __init__(self, name, unit, zero_max=2, one_max=6, mark_max=2, burst=True):
+        self.name = name
+        self.unit = unit
+        self.zero_max = zero_max
+        self.one_max = one_max
+        self.mark_max = mark_max
+        self.burst = burst
+
+class ManchesterTable(object):
+    """Bi-phase coding (RC5 style): frames of `bits` bits, starting with
+    `start_bit`, where each bit is a transition in the middle of its period.
+    """
+    matcher = ManchesterMatcher
+
+    def __init__(self, name, bits, start_bit=1, extra_bits=2, min_pulses=13, max_pulses=29):
+        self.name = name
+        self.bits = bits
+        self.start_bit = start_bit
+        self.extra_bits = extra_bits
+        self.min_pulses = min_pulses
+        self.max_pulses = max_pulses
+
+TABLES = []
+
+def register(table):
+    TABLES.append(table)
+    return table
+
+def scan(pulses, tables=None):
+    """Match a flat pulse train against several tables in one pass.
+
+    Returns a dict of table name to either a ScanResult or the DataError
+    that table failed with. The errors are kept without their traceback,
+    which would otherwise keep the calling frames (and codes) alive.
+    """
+    if tables is None:
+        tables = TABLES
+    results = {}
+    matchers = {t.name: t.matcher(t) for t in tables}
+    it = iter(pulses)
+    for mark, space in zip(it, it):
+        for name, matcher in list(matchers.items()):
+            try:
+                matcher.feed(mark, space)
+            except DataError as e:
+                results[name] = e.with_traceback(None)
+                del matchers[name]
+        if not matchers:
+            break
+    for name, matcher in matchers.items():
+        try:
+            results[name] = matcher.finish()
+        except DataError as e:
+            results[name] = e.with_traceback(None)
+    return results
+
+def scan_code(code, table):
+    """Return the ScanResult of `table` for a code, raising its DataError.
+
+    All registered tables are scanned together the first time, and the
+    results are kept with the code's (cached) flattened form, so that each
+    format of the same family does not rescan the pulses.
+    """
+    flat = code.to_raw().flatten(no_repeats=True, lazy=True)
+    results = getattr(flat, "_scan", None)
+    if results is None or table.name not in results:
+        tables = TABLES if table in TABLES else [table]
+        results = {**(results or {}), **scan(flat.data[0]["pulses"], tables)}
+        flat._scan = results
+    result = results[table.name]
+    if isinstance(result, Exception):
+        raise type(result)(*result.args)
+    return result
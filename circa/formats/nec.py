@@ -1,42 +1,64 @@
 #!/usr/bin/python
 
-import statistics
+import functools
 
 from ..core import *
-from ..util import to_bits_lsb, from_bits_lsb, to_bits_msb, from_bits_msb
-
-__all__ = ["NECCode", "NECBCode"]
+from ..util import to_bits_lsb, from_bits_lsb, to_bits_msb, from_bits_msb, pulse_array, freeze_packet
+from .engine import PulseDistanceTable, register, scan_code
+
+__all__ = ["NECCode", "NECBCode", "NECDecoder"]
+
+# Shared by NEC and NECB, which only differ in bit order
+PULSE_DISTANCE = register(PulseDistanceTable("pulse-distance", unit=563))
+
+@functools.lru_cache(maxsize=64)
+def _byte_pulses(endian, pulse_time, space_time_0, space_time_1):
+    # Mark/space pulses for each of the 256 byte values, for one set of timings
+    table = []
+    for byte in range(256):
+        pulses = pulse_array()
+        for bit in to_bits_lsb(byte, 8) if endian == "l" else to_bits_msb(byte, 8):
+            pulses.append(pulse_time)
+            pulses.append(space_time_1 if bit else space_time_0)
+        table.append(pulses)
+    return tuple(table)
 
 class NECCode(IRCode):
     NAMES = ["nec"]
     ENDIAN = "l"
 
-    def params(self):
-        yield from (i for i in super().params() if i[0] not in "packet_interval")
-        yield ("pulse_time", "tp", int, 563)
-        yield ("space_time_0", "t0", int, self.pulse_time)
-        yield ("space_time_1", "t1", int, self.pulse_time * 3)
-        yield ("preamble_time_high", "ph", int, self.pulse_time * 16)
-        yield ("preamble_time_low", "pl", int, self.preamble_time_high // 2)
-        yield ("repeat_time_high", "rh", int, self.preamble_time_high)
-        yield ("repeat_time_low", "rl", int, self.preamble_time_low // 2)
-        yield ("complement_mode", "cm", int, 0)
+    PARAMS = tuple(p for p in IRCode.PARAMS if p.name != "packet_interval") + (
+        Param("pulse_time", "tp", int, 563),
+        Param("space_time_0", "t0", int, lambda c: c.pulse_time),
+        Param("space_time_1", "t1", int, lambda c: c.pulse_time * 3),
+        Param("preamble_time_high", "ph", int, lambda c: c.pulse_time * 16),
+        Param("preamble_time_low", "pl", int, lambda c: c.preamble_time_high // 2),
+        Param("repeat_time_high", "rh", int, lambda c: c.preamble_time_high),
+        Param("repeat_time_low", "rl", int, lambda c: c.preamble_time_low // 2),
+        Param("complement_mode", "cm", int, 0),
         # 0 = No complementing
         # 1 = Complement data only
         # 2 = Complement address only
         # 3 = Complement address and data
-        yield ("address_bytes", "a", int, [-1, 2, 2, 1][self.complement_mode])
-        yield ("packet_gap", "pg", int, 0)
-        yield ("packet_interval", "pi", int, self.pulse_time * 192 if self.packet_gap == 0 else 0)
-        yield ("repeat_interval", "ri", int, self.packet_interval)
-        yield ("burst_count", "b", int, 0)
-        yield ("burst_time_high", "bh", int, self.pulse_time)
-        yield ("burst_time_low", "bl", int, self.pulse_time)
-        yield ("burst_gap", "bg", int, self.pulse_time * 60)
+        Param("address_bytes", "a", int, lambda c: [-1, 2, 2, 1][c.complement_mode]),
+        Param("packet_gap", "pg", int, 0),
+        Param("packet_interval", "pi", int, lambda c: c.pulse_time * 192 if c.packet_gap == 0 else 0),
+        Param("repeat_interval", "ri", int, lambda c: c.packet_interval),
+        Param("burst_count", "b", int, 0),
+        Param("burst_time_high", "bh", int, lambda c: c.pulse_time),
+        Param("burst_time_low", "bl", int, lambda c: c.pulse_time),
+        Param("burst_gap", "bg", int, lambda c: c.pulse_time * 60),
         # 0 = No checksum
         # 1 = sum mod 256 of data bytes, appended (no address)
         # 2 = xor of data bytes, appended (no address)
-        yield ("checksum_type", "ck", int, 0)
+        Param("checksum_type", "ck", int, 0),
+    )
+    __slots__ = tuple(p.name for p in PARAMS if p.name not in IRCode.__slots__)
+
+    @classmethod
+    def accepts(cls, stats):
+        # Preamble plus at least one byte and the stop bit, with constant marks
+        return stats.count >= 20 and stats.distance >= 0.75
 
     def _parse_packet(self, packet):
         for i in packet:
@@ -68,19 +90,15 @@ class NECCode(IRCode):
         address, data = packet[:self.data_start], packet[self.data_start:]
 
         if self.complement_mode & 1:
-            data = sum([[i, i ^ 0xff] for i in data], [])
+            data = [j for i in data for j in (i, i ^ 0xff)]
         if self.complement_mode & 2:
-            address = sum([[i, i ^ 0xff] for i in address], [])
+            address = [j for i in address for j in (i, i ^ 0xff)]
 
-        pulses = [self.preamble_time_high, self.preamble_time_low]
+        table = _byte_pulses(self.ENDIAN, self.pulse_time, self.space_time_0, self.space_time_1)
 
+        pulses = pulse_array([self.preamble_time_high, self.preamble_time_low])
         for byte in (address + data):
-            for bit in to_bits_lsb(byte, 8) if self.ENDIAN == "l" else to_bits_msb(byte, 8):
-                pulses.append(self.pulse_time)
-                if bit:
-                    pulses.append(self.space_time_1)
-                else:
-                    pulses.append(self.space_time_0)
+            pulses += table[byte]
 
         pulses.append(self.pulse_time)
         pulses.append(max(self.pulse_time, self.packet_gap))
@@ -88,121 +106,40 @@ class NECCode(IRCode):
 
         return 1, pulses
 
-    def to_raw(self, state=None):
-        raw_code = super().to_raw(state)
+    def _to_raw(self, state=None):
+        raw_code = super()._to_raw(state)
         raw_code.packet_interval = 0
         if self.burst_count:
             burst = [self.burst_time_high, self.burst_time_low] * self.burst_count
             burst[-1] = self.burst_gap
-            raw_code.data.insert(0, ({"count": 1, "pulses": burst}))
+            raw_code.data.insert(0, freeze_packet({"count": 1, "pulses": burst}))
         if self.count > 1:
-            raw_code.data.append({"count": self.count - 1, "pulses": [
+            raw_code.data.append(freeze_packet({"count": self.count - 1, "pulses": [
                 self.repeat_time_high, self.repeat_time_low, self.pulse_time,
                 max(self.pulse_time, self.repeat_interval - self.repeat_time_high - self.repeat_time_low - self.pulse_time)
-            ]})
+            ]}))
             raw_code.count = 1
         return raw_code
 
     def parse_code(self, code):
         self.fc = code.fc
 
-        code = code.to_raw().flatten(no_repeats=True)
-        pulses = code.data[0]["pulses"]
-
-        self._reset_samples()
-
-        packets = []
-        p = 0
-        repeats = 0
-
-        # Try to detect an initial burst...
-        if len(pulses) >= 4:
-            bmin = min(pulses[1:4])
-            bmax = max(pulses[:4])
-            bavg = sum(pulses[:4]) / 4
-            if pulses[0] < bavg * 1.5 and abs(bmin - bavg) / bavg < 0.3 and (bmax - bavg) / bavg < 0.3:
-                while p < (len(pulses)-1):
-                    bh, bl = pulses[p:p + 2]
-                    if bh > 2 * bavg:
-                        self._sample("burst_gap", pulses[p - 1])
-                        break
-                    self._sample("burst_time_high", bh)
-                    self.burst_count += 1
-                    p += 2
-                    if bl > 2 * bavg:
-                        self._sample("burst_gap", bl)
-                        break
-                    self._sample("burst_time_low", bl)
-
-        if len(pulses) <= p:
-            raise DataError("No data")
-
-        last_packet_length = None
-        while p < (len(pulses)-1):
-            packet_start = p
-            hh, hl = pulses[p:p + 2]
-            p += 2
-
-            bits = []
-
-            if p >= len(pulses):
-                # runt end pulse?
-                if not packets:
-                    raise DataError("No data")
-                break
-
-            if packets and not repeats:
-                self._sample("packet_gap", pulses[p - 3])
+        scan = scan_code(code, PULSE_DISTANCE)
+        self._set_samples(scan.samples)
+        self.burst_count = scan.burst_count
+        repeats = scan.repeats
 
-            while p < (len(pulses)-1):
-                mark, space = pulses[p:p+2]
-                if (bits or packets) and mark > self.pulse_time * 2:
-                    break
-                p += 2
-                self._sample("pulse_time", mark)
-                if space < self.pulse_time * 2:
-                    bits.append(0)
-                    self._sample("space_time_0", space)
-                elif space < self.pulse_time * 6:
-                    bits.append(1)
-                    self._sample("space_time_1", space)
-                else:
-                    bits.append(0) # end bit?
-                    break
-
-            if (len(bits) % 8) != 1:
-                raise DataError("Bit count not an even number of bytes")
-
-            if len(bits) > 1:
-                self._sample("preamble_time_high", hh)
-                self._sample("preamble_time_low", hl)
-                if repeats > 0:
-                    raise DataError("Data packet after a repeat packet")
-                if self.ENDIAN == "l":
-                    packets.append([from_bits_lsb(bits[i:i+8]) for i in range(0, len(bits) - 1, 8)])
-                else:
-                    packets.append([from_bits_msb(bits[i:i+8]) for i in range(0, len(bits) - 1, 8)])
-                if last_packet_length:
-                    self._sample("packet_interval", last_packet_length)
-            else:
-                self._sample("repeat_time_high", hh)
-                self._sample("repeat_time_low", hl)
-                if not packets:
-                    raise DataError("Repeat packet with no data packet")
-                if repeats > 0:
-                    self._sample("repeat_interval", last_packet_length)
-                else:
-                    self._sample("packet_interval", last_packet_length)
-                repeats += 1
-
-            last_packet_length = sum(pulses[packet_start:p])
+        if self.ENDIAN == "l":
+            packets = [[from_bits_lsb(bits[i:i+8]) for i in range(0, len(bits), 8)] for bits in scan.frames]
+        else:
+            packets = [[from_bits_msb(bits[i:i+8]) for i in range(0, len(bits), 8)] for bits in scan.frames]
 
         # Packet spacing can be specified with either an interval or a gap.
         # Pick whichever one works best.
         if "packet_interval" in self._samples and "packet_gap" in self._samples:
-            if len(self._samples["packet_interval"]) > 1 and len(self._samples["packet_gap"]) > 1:
-                vi = statistics.variance(self._samples["packet_interval"])
-                vg = statistics.variance(self._samples["packet_gap"])
+            if self._samples["packet_interval"].count > 1 and self._samples["packet_gap"].count > 1:
+                vi = self._samples["packet_interval"].variance
+                vg = self._samples["packet_gap"].variance
                 if vi > vg:
                     del self._samples["packet_interval"]
                 else:
@@ -294,3 +231,33 @@ class NECCode(IRCode):
 class NECBCode(NECCode):
     NAMES = ["necb"]
     ENDIAN = "b"
+    __slots__ = ()
+
+class NECDecoder(StreamDecoder):
+    # Relative timing tolerance for repeat frames
+    REPEAT_TOLERANCE = 0.3
+
+    def __init__(self, fmt=NECCode, gap=None, fc=38000):
+        self.fmt = fmt
+        if gap is None:
+            timing = fmt()
+            gap = 2 * max(timing.preamble_time_low, timing.space_time_1)
+        super().__init__(gap, fc)
+
+    def _is_repeat(self, pulses):
+        # Header, stop bit and gap, with the timing of the last packet
+        last = self.last
+        expected = last.repeat_time_high, last.repeat_time_low, last.pulse_time
+        return all(abs(p - e) <= e * self.REPEAT_TOLERANCE for p, e in zip(pulses, expected))
+
+    def decode_frame(self, frame):
+        pulses = frame.data[0]["pulses"]
+        if len(pulses) == 4:
+            if self.last is None or not self._is_repeat(pulses):
+                return []
+            self.last = self.last.clone()
+            self.last.count += 1
+            return [("repeat", self.last)]
+
+        self.last = self.fmt.from_code(frame)
+        return [("packet", self.last)]
@@ -9,6 +9,7 @@ __all__ = ["ProntoCode"]
 
 class ProntoCode(IRCode):
     NAMES = ["pronto"]
+    RAW = True
     # https://www.majority.nl/files/prontoirformats.pdf
     # Clock is claimed as 4.1455 ± 0.0006 Mhz
     # The original Pronto models had serial ports. This is
@@ -22,8 +23,8 @@ class ProntoCode(IRCode):
         self.count = 1
         self.packet_interval = 0
 
-    def params(self):
-        yield from ()
+    PARAMS = ()
+    __slots__ = ()
 
     def clone(self, data=True):
         new = super().clone(data)
@@ -52,7 +53,7 @@ class ProntoCode(IRCode):
 
         data = [0, base]
 
-        code = code.to_raw().flatten(no_repeats=True)
+        code = code.to_raw().flatten(no_repeats=True, lazy=True)
 
         pulses = scale_pulses(code.data[0]["pulses"], 1000000, self.fc)
 
@@ -2,16 +2,25 @@
 
 from ..core import *
 from ..util import to_bits_msb, from_bits_msb
+from .engine import ManchesterTable, register, scan_code
 
-__all__ = ["RC5Code"]
+__all__ = ["RC5Code", "RC5Decoder"]
+
+BIPHASE = register(ManchesterTable("rc5", bits=14))
 
 class RC5Code(IRCode):
     NAMES = ["rc5"]
 
-    def params(self):
-        yield from (i for i in super().params() if i[0] not in "packet_interval")
-        yield ("packet_interval", "ri", int, 113788)
-        yield ("bit_time", "tb", int, 889)
+    PARAMS = tuple(p for p in IRCode.PARAMS if p.name != "packet_interval") + (
+        Param("packet_interval", "ri", int, 113788),
+        Param("bit_time", "tb", int, 889),
+    )
+    __slots__ = ("bit_time",)
+
+    @classmethod
+    def accepts(cls, stats):
+        # No preamble, and (apart from packet gaps) only 1T and 2T pulses
+        return stats.count >= 14 and stats.preamble_ratio < 3 and stats.manchester >= 0.65
 
     def _parse_packet(self, packet):
         if isinstance(packet, list) or isinstance(packet, tuple):
@@ -70,90 +79,40 @@ class RC5Code(IRCode):
     def parse_code(self, code):
         self.fc = code.fc
 
-        code = code.to_raw().flatten(no_repeats=True)
-        pulses = list(code.data[0]["pulses"])
-
-        self._reset_samples()
+        scan = scan_code(code, BIPHASE)
+        self._set_samples(scan.samples)
 
         packets = []
-        p = 0
-
-        if not len(pulses):
-            raise DataError("No data")
-
-        # RC5 has no sane framing, so we need to guess
-        max_mark = max(pulses[::2])
-
-        # a space longer than 4 of the longest marks means a new packet
-        pause = max_mark * 4
-
-        packet_start = 0
-        last_packet_length = None
-        while p < (len(pulses)-1):
-            packet_start = p
-
-            times = []
-            while p < (len(pulses)-1):
-                mark, space = pulses[p:p + 2]
-                p += 2
-                if space > pause:
-                    break
-
-
-
-            times = pulses[packet_start:p - 1]
-            times.sort()
-
-            if len(times) < 13:
-                raise DataError("Packet too short")
-            if len(times) > 29:
-                raise DataError("Packet too long")
-
-            # Ignore the shortest pulse and longest pulse, in case of noise
-            min_time = min(times[1:])
-            max_time = max(times[:-1])
-
-            # If there isn't enough difference between the pulse times, we might have a special
-            # case of 10101010101010 or 11111111111111 or off by one bit
-            th = (min_time + max_time) / 2
-            if (max_time / min_time) < 1.3:
-                if len(times) <= 15:
-                    th = th * 0.75
-                elif len(times) >= 25:
-                    th = th * 1.5
-
-            bits = [1]
-            skip = False
-            for t in pulses[packet_start:p - 1]:
-                if t > th:
-                    if skip:
-                        raise DataError("Invalid Manchester encoding")
-                    self._sample("bit_time", t / 2)
-                    bits.append(bits[-1] ^ 1)
-                else:
-                    self._sample("bit_time", t)
-                    if skip:
-                        skip = False
-                    else:
-                        bits.append(bits[-1])
-                        skip = True
-
-            # Allow some garbage at the end
-            if not 14 <= len(bits) <= 16:
-                raise DataError(f"Packet length invalid: {len(bits)}")
-
-            bits = bits[:14]
+        for bits in scan.frames:
             toggle = bits[2]
             addr = from_bits_msb(bits[3:8])
             cmd = from_bits_msb([1 ^ bits[1]] + bits[8:14])
             packets.append((toggle, addr, cmd))
 
-            if last_packet_length:
-                self._sample("packet_interval", last_packet_length)
-            last_packet_length = sum(pulses[packet_start:p])
-
         if all(i == packets[0] for i in packets[1:]):
             self.count = len(packets)
             packets = [packets[0]]
 
         self.data = [{"addr": addr, "cmd": cmd} for toggle, addr, cmd in packets]
+
+class RC5Decoder(StreamDecoder):
+    def __init__(self, gap=None, fc=38000):
+        if gap is None:
+            # Same as parse_code: longer than 4 of the longest (2T) marks
+            gap = 8 * RC5Code().bit_time
+        super().__init__(gap, fc)
+        self.toggle = None
+
+    def decode_frame(self, frame):
+        code = RC5Code.from_code(frame)
+        # The code drops the toggle bit, which tells a held key (unchanged)
+        # from a new press of the same key (flipped)
+        toggle = scan_code(frame, BIPHASE).frames[0][2]
+        if self.last is not None and code.data == self.last.data and toggle == self.toggle:
+            self.last = self.last.clone()
+            self.last.count += 1
+            return [("repeat", self.last)]
+
+        self.last = code
+        self.toggle = toggle
+        return [("packet", self.last)]
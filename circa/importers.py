@@ -0,0 +1,306 @@
+#!/usr/bin/python
+import csv, os
+
+from .core import *
+from .formats.nec import NECCode
+from .formats.rc5 import RC5Code
+
+__all__ = ["read_lirc", "read_irdb_csv", "read_flipper", "IMPORTERS", "find_importer", "find_files", "read_file"]
+
+# Readers take an iterable of text lines and lazily yield (name, code)
+# pairs, so files of any size are streamed. Entries using protocols that
+# have no equivalent here are skipped.
+
+def _lirc_int(s):
+    # Hex with 0x, decimal otherwise (leading zeros are allowed)
+    return int(s, 16 if s[:2].lower() == "0x" else 10)
+
+def _int(s, lineno, base=10):
+    try:
+        return _lirc_int(s) if base is None else int(s, base)
+    except ValueError:
+        raise ParseError(f"line {lineno}: invalid number {s!r}")
+
+class _PulseBuilder(object):
+    # Mark/space sequence that merges consecutive marks or spaces
+    def __init__(self):
+        self.pulses = []
+
+    def add(self, mark, t):
+        # (a leading space has nothing to follow, the train starts with a mark)
+        if not t or not self.pulses and not mark:
+            return
+        if (len(self.pulses) % 2 == 0) == mark:
+            self.pulses.append(t)
+        else:
+            self.pulses[-1] += t
+
+    def end(self, gap, const_length=False):
+        if const_length:
+            gap = max(0, gap - sum(self.pulses))
+        if len(self.pulses) % 2:
+            self.pulses.append(gap or 1000)
+        else:
+            self.pulses[-1] += gap
+        return self.pulses
+
+class _LircRemote(object):
+    # Encodings other than plain pulse-distance/width (space_enc) or raw
+    UNSUPPORTED = {"RC5", "RC6", "RCMM", "SHIFT_ENC", "SPACE_FIRST", "GRUNDIG", "BO", "SERIAL", "XMP", "MCE"}
+
+    def __init__(self):
+        self.name = None
+        self.flags = set()
+        self.values = {}
+
+    def get(self, key, default=0):
+        return self.values.get(key, [default])
+
+    @property
+    def supported(self):
+        return not (self.flags & self.UNSUPPORTED)
+
+    @property
+    def fc(self):
+        return self.get("frequency", 38000)[0] or 38000
+
+    def pair(self, key):
+        # (mark, space) pair, only sent by lircd if both are set
+        mark, space = (self.get(key) + [0, 0])[:2]
+        return (mark, space) if mark and space else None
+
+    def check(self, lineno):
+        # Data bits need both timing pairs, which lircd requires anyway
+        for key in ("one", "zero"):
+            if len(self.get(key, None)) < 2:
+                raise ParseError(f"line {lineno}: remote {self.name!r} has no valid {key!r} timing")
+
+    def _add_data(self, b, data, bits):
+        one = self.get("one")[:2]
+        zero = self.get("zero")[:2]
+        order = range(bits) if "REVERSE" in self.flags else range(bits - 1, -1, -1)
+        for i in order:
+            mark, space = one if data & (1 << i) else zero
+            b.add(True, mark)
+            b.add(False, space)
+
+    def encode(self, value):
+        # Same sequence as lircd sends: header, lead, pre_data, pre, data,
+        # post, post_data, trail, foot (space first), then the gap
+        b = _PulseBuilder()
+        header = self.pair("header")
+        if header:
+            b.add(True, header[0])
+            b.add(False, header[1])
+        b.add(True, self.get("plead")[0])
+        pre_bits = self.get("pre_data_bits")[0]
+        if pre_bits:
+            self._add_data(b, self.get("pre_data")[0], pre_bits)
+            pre = self.pair("pre")
+            if pre:
+                b.add(True, pre[0])
+                b.add(False, pre[1])
+        self._add_data(b, value, self.get("bits")[0])
+        post_bits = self.get("post_data_bits")[0]
+        if post_bits:
+            post = self.pair("post")
+            if post:
+                b.add(True, post[0])
+                b.add(False, post[1])
+            self._add_data(b, self.get("post_data")[0], post_bits)
+        b.add(True, self.get("ptrail")[0])
+        foot = self.pair("foot")
+        if foot:
+            b.add(False, foot[1])
+            b.add(True, foot[0])
+        return b.end(self.get("gap")[0], "CONST_LENGTH" in self.flags)
+
+    def raw(self, pulses):
+        b = _PulseBuilder()
+        for i, t in enumerate(pulses):
+            b.add(i % 2 == 0, t)
+        return b.end(self.get("gap")[0])
+
+def read_lirc(lines):
+    """Read a LIRC lircd.conf (space_enc and raw_codes remotes)."""
+    remote = None
+    section = None
+    raw_name = raw_pulses = None
+
+    def flush_raw():
+        if raw_name is not None and remote.supported:
+            return RawCode(remote.raw(raw_pulses), fc=remote.fc)
+
+    for lineno, line in enumerate(lines, 1):
+        words = line.split("#", 1)[0].split()
+        if not words:
+            continue
+        key = words[0].lower()
+
+        if key == "begin" and len(words) > 1:
+            if words[1] == "remote":
+                remote = _LircRemote()
+            elif remote is not None:
+                section = words[1]
+                if section == "codes" and remote.supported:
+                    remote.check(lineno)
+            continue
+        if key == "end" and len(words) > 1:
+            if words[1] == "raw_codes" and remote is not None:
+                code = flush_raw()
+                if code is not None:
+                    yield f"{remote.name}/{raw_name}", code
+                raw_name = None
+            if words[1] == "remote":
+                remote = None
+            section = None
+            continue
+        if remote is None:
+            continue
+
+        if section == "codes":
+            if remote.supported and len(words) > 1:
+                yield f"{remote.name}/{words[0]}", RawCode(remote.encode(_int(words[1], lineno, None)), fc=remote.fc)
+        elif section == "raw_codes":
+            if key == "name":
+                code = flush_raw()
+                if code is not None:
+                    yield f"{remote.name}/{raw_name}", code
+                raw_name = words[1] if len(words) > 1 else ""
+                raw_pulses = []
+            elif raw_name is not None:
+                raw_pulses += [_int(i, lineno, 10) for i in words]
+        elif key == "name":
+            remote.name = words[1] if len(words) > 1 else ""
+        elif key == "flags":
+            remote.flags = set(" ".join(words[1:]).replace(" ", "").upper().split("|"))
+        else:
+            try:
+                remote.values[key] = [_lirc_int(i) for i in words[1:]]
+            except ValueError:
+                # Not a timing/data value (e.g. driver, manual_sort)
+                pass
+
+def _nec(address, command):
+    # Standard NEC: complemented address and command. Extended NEC: 16-bit
+    # address, complemented command.
+    if len(address) == 1 or address[1] == address[0] ^ 0xff:
+        return NECCode([[address[0], command]], complement_mode=3)
+    return NECCode([[address[0], address[1], command]], complement_mode=1)
+
+def read_irdb_csv(lines):
+    """Read an IRDB-style CSV file (functionname, protocol, device,
+    subdevice, function). NEC and RC5 entries are supported, other and
+    invalid rows are skipped."""
+    for row in csv.DictReader(lines):
+        try:
+            name = row["functionname"]
+            protocol = row["protocol"].upper()
+            device = int(row["device"])
+            subdevice = int(row["subdevice"])
+            function = int(row["function"])
+            if protocol in ("NEC", "NEC1", "NEC2"):
+                address = [device] if subdevice < 0 else [device, subdevice]
+                code = _nec(address, function)
+            elif protocol == "RC5":
+                code = RC5Code([(device, function)])
+            else:
+                continue
+        except (KeyError, TypeError, ValueError, AttributeError, DataError):
+            continue
+        yield name, code
+
+def _flipper_code(entry, lineno):
+    name = entry.get("name", "")
+    if entry.get("type") == "raw":
+        pulses = [_int(i, lineno, 10) for i in entry.get("data", "").split()]
+        if len(pulses) % 2:
+            pulses.append(1000)
+        return name, RawCode(pulses, fc=_int(entry.get("frequency", "38000"), lineno, 10))
+
+    protocol = entry.get("protocol", "")
+    try:
+        # (always 4 bytes, little endian)
+        address = [int(i, 16) for i in entry["address"].split()][:4]
+        command = [int(i, 16) for i in entry["command"].split()][:4]
+        if len(address) < 2 or len(command) < 2:
+            raise ValueError()
+    except (KeyError, ValueError):
+        raise ParseError(f"line {lineno}: invalid address/command")
+    if protocol == "NEC":
+        return name, _nec(address[:1], command[0])
+    elif protocol == "NECext":
+        if command[1] == command[0] ^ 0xff:
+            return name, _nec(address[:2], command[0])
+        return name, NECCode([address[:2] + command[:2]])
+    elif protocol in ("RC5", "RC5X"):
+        return name, RC5Code([(address[0], command[0])])
+    return None
+
+def read_flipper(lines):
+    """Read a Flipper Zero .ir signal file (raw, NEC, NECext and RC5/RC5X
+    signals)."""
+    entry = {}
+    lineno = 0
+    for lineno, line in enumerate(lines, 1):
+        line = line.strip()
+        if line.startswith("#"):
+            continue
+        key, sep, value = line.partition(":")
+        if not sep:
+            continue
+        key = key.strip()
+        value = value.strip()
+        if key == "name":
+            if "type" in entry:
+                code = _flipper_code(entry, lineno)
+                if code is not None:
+                    yield code
+            entry = {}
+        if key == "data" and "data" in entry:
+            # long raw signals are split over several data lines
+            entry["data"] += " " + value
+        else:
+            entry[key] = value
+    if "type" in entry:
+        code = _flipper_code(entry, lineno)
+        if code is not None:
+            yield code
+
+IMPORTERS = {
+    "lirc": read_lirc,
+    "irdb": read_irdb_csv,
+    "flipper": read_flipper,
+}
+
+def find_importer(path):
+    """Guess the importer for a file from its name, None if unknown."""
+    name = os.path.basename(path).lower()
+    if name.endswith(".ir"):
+        return "flipper"
+    elif name.endswith(".csv"):
+        return "irdb"
+    elif name.endswith((".conf", ".lircd")) or name.startswith("lircd"):
+        return "lirc"
+    return None
+
+def find_files(paths, kind=None):
+    """Yield (path, importer name) for the given files and everything in the
+    given directory trees. Without `kind`, only recognized files are
+    returned."""
+    for path in paths:
+        if os.path.isdir(path):
+            files = (os.path.join(root, f)
+                     for root, dirs, names in sorted(os.walk(path))
+                     for f in sorted(names))
+        else:
+            files = [path]
+        for f in files:
+            fkind = kind or find_importer(f)
+            if fkind is not None:
+                yield f, fkind
+
+def read_file(path, kind):
+    """Yield (name, code) for every code in a file."""
+    with open(path, "r", encoding="utf-8", errors="replace", newline="") as fd:
+        yield from IMPORTERS[kind](fd)
@@ -0,0 +1,120 @@
+#!/usr/bin/python
+import sqlite3, sys
+
+from . import from_string, try_decode, PulseStats, _flat_pulses, _score_pulse_lists
+from .util import pulse_array
+
+__all__ = ["CodeLibrary"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS codes (
+    id INTEGER PRIMARY KEY,
+    name TEXT,
+    code TEXT NOT NULL,
+    decoded TEXT,
+    protocol TEXT,
+    fc INTEGER,
+    pulse_count INTEGER NOT NULL,
+    unit INTEGER NOT NULL,
+    pulses BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS codes_shape ON codes (pulse_count, unit);
+CREATE INDEX IF NOT EXISTS codes_protocol ON codes (protocol, pulse_count, unit);
+"""
+
+def _pack(pulses):
+    a = pulse_array(pulses)[:]
+    if sys.byteorder == "big":
+        a.byteswap()
+    return a.tobytes()
+
+def _unpack(blob):
+    a = pulse_array()
+    a.frombytes(blob)
+    if sys.byteorder == "big":
+        a.byteswap()
+    return a
+
+class CodeLibrary(object):
+    """SQLite-backed store of known codes with nearest-neighbour lookup.
+
+    Each code is stored with its canonical (flattened) raw pulse train and
+    its best decoding. Lookups only score entries with a similar pulse
+    count and base time unit (and optionally the same protocol), which is
+    what compare_codes() would rank highly anyway.
+    """
+    # Candidate search window: compare_codes() penalizes every pulse of
+    # length difference past the first by 20%, and timings by their ratio.
+    COUNT_SLACK = 4
+    UNIT_SLACK = 0.3
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, code, name=None, decode=True):
+        if isinstance(code, str):
+            code = from_string(code)
+        pulses = _flat_pulses(code)
+        stats = PulseStats(pulses)
+
+        decoded = protocol = None
+        if not code.RAW:
+            decoded, protocol = code.to_string(), code.NAMES[0]
+        elif decode:
+            for score, guess in try_decode(code):
+                if not guess.RAW:
+                    decoded, protocol = guess.to_string(), guess.NAMES[0]
+                    break
+
+        with self.db:
+            cur = self.db.execute(
+                "INSERT INTO codes (name, code, decoded, protocol, fc, pulse_count, unit, pulses) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (name, code.to_string(), decoded, protocol, code.fc, len(pulses), stats.unit, _pack(pulses)))
+        return cur.lastrowid
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM codes").fetchone()[0]
+
+    def get(self, id):
+        row = self.db.execute("SELECT name, code FROM codes WHERE id = ?", (id,)).fetchone()
+        if row is None:
+            raise KeyError(id)
+        return row[0], from_string(row[1])
+
+    def _candidates(self, pulses, protocol=None):
+        stats = PulseStats(pulses)
+        query = ("SELECT id, name, code, decoded, pulses FROM codes "
+                 "WHERE pulse_count BETWEEN ? AND ? AND unit BETWEEN ? AND ?")
+        args = [len(pulses) - self.COUNT_SLACK, len(pulses) + self.COUNT_SLACK,
+                int(stats.unit * (1 - self.UNIT_SLACK)), int(stats.unit * (1 + self.UNIT_SLACK)) + 1]
+        if protocol is not None:
+            query += " AND protocol = ?"
+            args.append(protocol)
+        return self.db.execute(query, args).fetchall()
+
+    def lookup(self, code, k=5, min_score=0.5, protocol=None):
+        """Return up to k (score, id, name, code, decoded) tuples, best first."""
+        if isinstance(code, str):
+            code = from_string(code)
+        pulses = _flat_pulses(code)
+        rows = self._candidates(pulses, protocol)
+        if not rows:
+            return []
+
+        scores = _score_pulse_lists(pulses, [_unpack(row[4]) for row in rows])
+        matches = [(score, id, name, code, decoded)
+                   for score, (id, name, code, decoded, blob) in zip(scores, rows)
+                   if score >= min_score]
+        matches.sort(reverse=True, key=lambda m: m[0])
+        return matches[:k]
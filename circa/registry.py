@@ -0,0 +1,79 @@
+#!/usr/bin/python
+import importlib
+
+from .core import ParseError
+
+__all__ = ["Registry"]
+
+class Registry(object):
+    """Classes (formats or devices) looked up by name, imported on first use.
+
+    Entries are either classes, or "module:Class" references registered with
+    the names they answer to, so that finding one only imports its module.
+    Other packages can add entries to the `group` entry point group, named
+    after the format or device name they provide.
+
+    Iterating over the registry imports and returns every class, in
+    registration order, followed by the entry point ones.
+    """
+
+    def __init__(self, kind, group):
+        self.kind = kind
+        self.group = group
+        self.entries = []
+        self.names = {}
+        self.plugins_loaded = False
+
+    def register(self, target, names=None):
+        if names is None:
+            names = target.NAMES
+        entry = [target]
+        self.entries.append(entry)
+        for name in names:
+            self.names.setdefault(name.lower(), entry)
+        return target
+
+    append = register
+
+    def _load(self, entry):
+        target = entry[0]
+        if isinstance(target, str):
+            modname, attr = target.split(":", 1)
+            entry[0] = getattr(importlib.import_module(modname, __package__), attr)
+        elif not isinstance(target, type):
+            # entry point
+            entry[0] = target.load()
+        return entry[0]
+
+    def _load_plugins(self):
+        if self.plugins_loaded:
+            return
+        self.plugins_loaded = True
+        # (importlib.metadata is itself slow to import)
+        try:
+            from importlib.metadata import entry_points
+        except ImportError:
+            return
+        try:
+            eps = entry_points(group=self.group)
+        except TypeError:
+            eps = entry_points().get(self.group, [])
+        for ep in eps:
+            self.register(ep, [ep.name])
+
+    def find(self, name):
+        entry = self.names.get(name.lower())
+        if entry is None:
+            self._load_plugins()
+            entry = self.names.get(name.lower())
+        if entry is None:
+            raise ParseError(f"{self.kind} type {name} not supported")
+        return self._load(entry)
+
+    def __iter__(self):
+        self._load_plugins()
+        return iter([self._load(entry) for entry in self.entries])
+
+    def __len__(self):
+        self._load_plugins()
+        return len(self.entries)
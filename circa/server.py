@@ -0,0 +1,152 @@
+#!/usr/bin/python
+import json, asyncio, os, socket as _socket, stat
+
+from . import from_string, try_decode, find_format, find_async_device, CircaError
+
+__all__ = ["Server", "serve"]
+
+class Server(object):
+    """JSON request server.
+
+    Requests and responses are JSON objects, one per line. Each request has
+    a `cmd` (convert, decode, transmit or receive) and the arguments the
+    matching CLI subcommand takes, plus an optional `id` that is copied to
+    the response. Responses have `ok` set, and either the result or an
+    `error` message.
+
+    Device sessions are opened on first use and kept (and re-authenticated
+    as needed) for the lifetime of the server.
+    """
+
+    def __init__(self):
+        self.devices = {}
+
+    async def get_device(self, spec):
+        dev = self.devices.get(spec)
+        if dev is None:
+            devtype, params = spec.split(":", 1)
+            dev = find_async_device(devtype)(params)
+            self.devices[spec] = dev
+        try:
+            await dev.open()
+        except:
+            self.devices.pop(spec, None)
+            raise
+        return dev
+
+    async def close(self):
+        devices, self.devices = self.devices, {}
+        for dev in devices.values():
+            await dev.close()
+
+    def _decode(self, code, options):
+        return [{"score": score, "code": guess.to_string()} for score, guess in try_decode(code, **options)]
+
+    async def _guesses(self, code, req):
+        options = {k: req[k] for k in ("max_results", "min_score", "confident") if req.get(k) is not None}
+        # Decoding is CPU bound, keep it off the event loop so other clients
+        # and device sessions are not stalled
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._decode, code, options)
+
+    async def do_convert(self, req):
+        code = from_string(req["code"])
+        target = find_format(req["format"]) if req.get("format") else type(code)
+        converted = target.from_code(code)
+        if req.get("threshold") is not None:
+            converted.simplify_params(req["threshold"])
+        if req.get("structure"):
+            return {"code": converted.to_struct()}
+        return {"code": converted.to_string()}
+
+    async def do_decode(self, req):
+        return {"guesses": await self._guesses(from_string(req["code"]), req)}
+
+    async def do_transmit(self, req):
+        code = from_string(req["code"])
+        dev = await self.get_device(req["device"])
+        await dev.transmit(code)
+        return {}
+
+    async def do_receive(self, req):
+        dev = await self.get_device(req["device"])
+        code = await dev.receive(req.get("timeout"))
+        if code is None:
+            return {"code": None}
+        return {"code": code.to_string(), "guesses": await self._guesses(code, req)}
+
+    async def handle(self, req):
+        resp = {}
+        try:
+            if not isinstance(req, dict):
+                raise ValueError("Request is not an object")
+            if "id" in req:
+                resp["id"] = req["id"]
+            fn = getattr(self, "do_" + str(req.get("cmd")), None)
+            if fn is None:
+                raise ValueError(f"Unknown command: {req.get('cmd')!r}")
+            resp.update(await fn(req))
+            resp["ok"] = True
+        except (CircaError, ValueError, OSError) as e:
+            resp["ok"] = False
+            resp["error"] = str(e)
+        except KeyError as e:
+            resp["ok"] = False
+            resp["error"] = f"Missing argument: {e}"
+        except Exception as e:
+            # Malformed arguments (wrong types and such)
+            resp["ok"] = False
+            resp["error"] = f"{type(e).__name__}: {e}"
+        return resp
+
+    async def client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    req = json.loads(line)
+                except ValueError as e:
+                    resp = {"ok": False, "error": f"Invalid JSON: {e}"}
+                else:
+                    resp = await self.handle(req)
+                writer.write(json.dumps(resp).encode("utf-8") + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+# Requests can carry long codes
+LINE_LIMIT = 1 << 20
+
+def _remove_stale_socket(path):
+    # A socket file left behind by a server that did not shut down cleanly
+    try:
+        if not stat.S_ISSOCK(os.stat(path).st_mode):
+            return
+    except FileNotFoundError:
+        return
+    with _socket.socket(_socket.AF_UNIX, _socket.SOCK_STREAM) as s:
+        try:
+            s.connect(path)
+        except ConnectionRefusedError:
+            os.unlink(path)
+            return
+    raise OSError(f"Socket {path!r} is in use by a running server")
+
+async def serve(socket=None, host="127.0.0.1", port=None):
+    server = Server()
+    if socket is not None:
+        _remove_stale_socket(socket)
+        listener = await asyncio.start_unix_server(server.client, socket, limit=LINE_LIMIT)
+    else:
+        listener = await asyncio.start_server(server.client, host, port, limit=LINE_LIMIT)
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        await server.close()
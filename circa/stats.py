@@ -0,0 +1,64 @@
+#!/usr/bin/python
+import time, contextlib, contextvars
+from collections import Counter
+
+__all__ = ["DecodeStats", "collect_stats"]
+
+class DecodeStats(object):
+    """Per-stage timings and outcomes collected by try_decode().
+
+    Entries are keyed by (stage, format, threshold, outcome), where the
+    outcome is "ok" or the name of the exception that made the stage fail.
+    """
+
+    def __init__(self, callback=None):
+        self.calls = Counter()
+        self.seconds = Counter()
+        self.callback = callback
+
+    def lap(self, stage, fmt, start, threshold=None, outcome="ok"):
+        now = time.perf_counter()
+        key = (stage, fmt, threshold, outcome)
+        self.calls[key] += 1
+        self.seconds[key] += now - start
+        if self.callback is not None:
+            self.callback(stage, fmt, threshold, outcome, now - start)
+        return now
+
+    @property
+    def errors(self):
+        errors = Counter()
+        for (stage, fmt, threshold, outcome), n in self.calls.items():
+            if stage == "from_code" and outcome != "ok":
+                errors[(fmt, outcome)] += n
+        return errors
+
+    def to_struct(self):
+        struct = []
+        for key in sorted(self.calls, key=lambda k: tuple(str(i) for i in k)):
+            stage, fmt, threshold, outcome = key
+            struct.append({"stage": stage, "format": fmt, "threshold": threshold, "outcome": outcome,
+                           "calls": self.calls[key], "seconds": self.seconds[key]})
+        return struct
+
+    def format(self):
+        lines = [f"{'stage':<16} {'format':<14} {'thresh':>6} {'calls':>6} {'total ms':>10} {'mean us':>9}  outcome"]
+        for s in self.to_struct():
+            threshold = "" if s["threshold"] is None else s["threshold"]
+            lines.append(f"{s['stage']:<16} {s['format']:<14} {threshold:>6} {s['calls']:>6} "
+                         f"{s['seconds'] * 1000:>10.3f} {s['seconds'] / s['calls'] * 1e6:>9.1f}  {s['outcome']}")
+        return "\n".join(lines)
+
+# Per context (thread or task), since try_decode() also runs in executors
+active = contextvars.ContextVar("circa_decode_stats", default=None)
+
+@contextlib.contextmanager
+def collect_stats(stats=None):
+    """Collect DecodeStats for every try_decode() call inside the block."""
+    if stats is None:
+        stats = DecodeStats()
+    token = active.set(stats)
+    try:
+        yield stats
+    finally:
+        active.reset(token)
@@ -0,0 +1,73 @@
+#!/usr/bin/python
+import pytest
+
+from circa import from_string, DataError
+from circa.archive import CaptureArchive, CaptureWriter
+
+CODES = [
+    "nec:c=3:12,34",
+    "rc5:c=2:1,10",
+    "raw:f=36000:9000,4500,560,560,560,1690,560,40000",
+    "necb:a=2:80,c5,61;80,c5,71",
+]
+
+def _raw(code):
+    raw = code.to_raw()
+    packets = [(list(i["pulses"]), i.get("count", 1)) for i in raw.data]
+    return raw.fc, raw.count, raw.packet_interval, packets
+
+def _write(path, codes):
+    with CaptureWriter(path) as w:
+        for s in codes:
+            w.append(from_string(s))
+
+@pytest.mark.parametrize("copy", [False, True])
+def test_round_trip(tmp_path, copy):
+    path = str(tmp_path / "a.cap")
+    _write(path, CODES)
+    with CaptureArchive(path, copy=copy) as arc:
+        assert len(arc) == len(CODES)
+        assert [_raw(c) for c in arc] == [_raw(from_string(s)) for s in CODES]
+        assert _raw(arc[-1]) == _raw(from_string(CODES[-1]))
+        with pytest.raises(IndexError):
+            arc[len(CODES)]
+
+def test_captures_are_read_only(tmp_path):
+    path = str(tmp_path / "a.cap")
+    _write(path, CODES[:1])
+    with CaptureArchive(path) as arc:
+        code = arc[0]
+        with pytest.raises(TypeError):
+            code.data[0]["pulses"] = []
+
+def test_append(tmp_path):
+    path = str(tmp_path / "a.cap")
+    _write(path, CODES[:2])
+    _write(path, CODES[2:])
+    with CaptureArchive(path) as arc:
+        assert [_raw(c) for c in arc] == [_raw(from_string(s)) for s in CODES]
+
+def test_unclosed_writer(tmp_path):
+    # Without an index, readers walk the records; a partial record at the
+    # end is ignored, and dropped by the next writer
+    path = str(tmp_path / "a.cap")
+    w = CaptureWriter(path)
+    for s in CODES:
+        w.append(from_string(s))
+    w.fd.close()
+    with open(path, "r+b") as fd:
+        fd.truncate(fd.seek(0, 2) - 4)
+    with CaptureArchive(path) as arc:
+        assert [_raw(c) for c in arc] == [_raw(from_string(s)) for s in CODES[:-1]]
+
+    _write(path, CODES[-1:])
+    with CaptureArchive(path) as arc:
+        assert [_raw(c) for c in arc] == [_raw(from_string(s)) for s in CODES]
+
+def test_not_an_archive(tmp_path):
+    path = tmp_path / "a.cap"
+    path.write_bytes(b"not a capture archive")
+    with pytest.raises(DataError):
+        CaptureArchive(str(path))
+    with pytest.raises(DataError):
+        CaptureWriter(str(path))
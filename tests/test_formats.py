@@ -0,0 +1,96 @@
+#!/usr/bin/python
+import gzip, os, random
+
+import pytest
+
+import circa
+from circa import from_string, find_format, try_decode
+
+DATA = os.path.join(os.path.dirname(__file__), "data")
+PARITY_FORMATS = ("nec", "necb", "rc5")
+
+def _parity_inputs(n=3000, seed=14):
+    # Clean and jittered NEC, NECB and RC5 codes as raw strings
+    rng = random.Random(seed)
+    for i in range(n):
+        kind = rng.choice(["nec", "necb", "rc5"])
+        c = rng.randint(1, 4)
+        if kind == "rc5":
+            s = f"rc5:c={c}:{rng.randint(0, 31)},{rng.randint(0, 127)}"
+        else:
+            s = f"{kind}:c={c}:{rng.randint(0, 255):02x},{rng.randint(0, 255):02x}"
+        j = rng.choice([0, 0.05, 0.1, 0.2, 0.3])
+        pulses = from_string(s).to_raw().flatten().data[0]["pulses"]
+        pulses = [max(1, int(x * rng.uniform(1 - j, 1 + j))) for x in pulses]
+        yield "raw:" + ",".join(map(str, pulses))
+
+def _from_code_results(raw):
+    results = []
+    for fmt in PARITY_FORMATS:
+        try:
+            results.append(find_format(fmt).from_code(from_string(raw)).to_string())
+        except Exception as e:
+            results.append("!" + type(e).__name__)
+    return results
+
+def test_from_code_parity():
+    # Expected results were recorded with the original (unoptimized) decoders
+    with gzip.open(os.path.join(DATA, "from_code.tsv.gz"), "rt") as fd:
+        expected = [line.rstrip("\n").split("\t") for line in fd]
+    inputs = list(_parity_inputs())
+    assert len(inputs) == len(expected)
+    mismatches = [(raw, exp, got) for raw, exp in zip(inputs, expected)
+                  for got in [_from_code_results(raw)] if got != exp]
+    assert mismatches[:5] == []
+
+@pytest.mark.parametrize("s", [
+    "rc5:1,10",
+    "rc5:c=3:31,127",
+    "nec:c=2:01,06",
+    "nec:c=20,a=1:12,34",
+    "necb:a=2:80,c5,61;80,c5,71",
+])
+def test_string_round_trip(s):
+    code = from_string(s)
+    assert code.to_string() == s
+    assert type(code).from_code(code.to_raw()).data == code.data
+
+def test_decode_2t_first_mark_rc5():
+    # RC5 code starting with a 2T mark, with jitter
+    code = from_string("raw:f=38000,c=4:2160,739,856,1861,1459,2058,983,724,1070,843,"
+                       "1700,774,984,962,970,767,766,2109,896,721,896,93280")
+    guesses = [str(guess) for score, guess in try_decode(code)]
+    assert "rc5:c=4:23,67" in guesses
+
+def test_decode_low_score_simplification():
+    # The unsimplified code scores below the simplification cut-off, so
+    # thresholds that change nothing must not add simplified guesses
+    code = from_string("raw:f=38000,c=3:2076,720,1020,790,1007,961,875,2092,1007,1082,"
+                       "1068,917,980,955,1699,888,892,1555,795,1023,2048,98549")
+    guesses = [str(guess) for score, guess in try_decode(code) if guess.NAMES[0] == "rc5"]
+    assert guesses == ["rc5:c=3,ri=122999,tb=939:7,102"]
+
+def _feed_all(decoder, codes):
+    # Feed raw codes as one stream, with a gap after each
+    events = []
+    for code in codes:
+        pulses = list(code.flatten().data[0]["pulses"])
+        pulses[-1] = max(pulses[-1], decoder.gap)
+        events += decoder.feed(pulses)
+    return events + decoder.flush()
+
+def test_rc5_decoder_toggle():
+    # A held key repeats the frame with the same toggle bit, a new press of
+    # the same key flips it
+    state = {}
+    frame = from_string("rc5:5,12")
+    press1 = [frame.to_raw(state)] * 2
+    press2 = [frame.to_raw(state)] * 2
+    events = _feed_all(circa.RC5Decoder(), press1 + press2)
+    assert [kind for kind, code in events] == ["packet", "repeat", "packet", "repeat"]
+    assert all(str(code).endswith(":5,12") for kind, code in events)
+
+def test_nec_decoder_repeats():
+    events = _feed_all(circa.NECDecoder(), [from_string("nec:c=3:12,34").to_raw()])
+    assert [kind for kind, code in events] == ["packet", "repeat", "repeat"]
+    assert events[-1][1].count == 3
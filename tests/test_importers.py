@@ -0,0 +1,137 @@
+#!/usr/bin/python
+import pytest
+
+from circa import from_string, ParseError
+from circa.formats.nec import NECCode
+from circa.importers import read_lirc, read_irdb_csv, read_flipper, find_importer
+
+LIRC = """
+# NEC remote, as written by irrecord
+begin remote
+  name  tv
+  bits           16
+  flags SPACE_ENC|CONST_LENGTH
+  eps            30
+  aeps          100
+  header       9000  4500
+  one           560  1690
+  zero          560   560
+  ptrail        560
+  repeat       9000  2250
+  pre_data_bits   16
+  pre_data       0x20DF
+  gap          108000
+  toggle_bit_mask 0x0
+  begin codes
+      KEY_POWER                0x10EF
+      KEY_MUTE                 0x906F
+  end codes
+end remote
+
+begin remote
+  name  learned
+  flags RAW_CODES
+  eps            30
+  aeps          100
+  gap          40000
+  begin raw_codes
+    name KEY_1
+      900 900 1800
+      900 900
+    name KEY_2
+      900 1800 900
+  end raw_codes
+end remote
+"""
+
+def test_lirc():
+    codes = dict(read_lirc(LIRC.splitlines()))
+    assert list(codes) == ["tv/KEY_POWER", "tv/KEY_MUTE", "learned/KEY_1", "learned/KEY_2"]
+    # Round trip through the NEC decoder
+    assert NECCode.from_code(codes["tv/KEY_POWER"]).data == [[0x04, 0x08]]
+    assert NECCode.from_code(codes["tv/KEY_MUTE"]).data == [[0x04, 0x09]]
+    # CONST_LENGTH: the gap is measured from the start of the frame
+    pulses = codes["tv/KEY_POWER"].data[0]["pulses"]
+    assert sum(pulses) == 108000
+    assert list(codes["learned/KEY_1"].data[0]["pulses"]) == [900, 900, 1800, 900, 900, 40000]
+    assert list(codes["learned/KEY_2"].data[0]["pulses"]) == [900, 1800, 900, 40000]
+
+def test_lirc_missing_timing():
+    lines = LIRC.replace("  one           560  1690\n", "  one           560\n").splitlines()
+    with pytest.raises(ParseError, match="line 18"):
+        list(read_lirc(lines))
+
+def test_lirc_unsupported():
+    lines = LIRC.replace("SPACE_ENC|CONST_LENGTH", "RC5").splitlines()
+    assert [name for name, code in read_lirc(lines)] == ["learned/KEY_1", "learned/KEY_2"]
+
+IRDB = """functionname,protocol,device,subdevice,function
+POWER,NEC1,4,-1,8
+INPUT,NEC1,4,32,9
+VOL+,RC5,0,-1,16
+BAD,NEC1,x,-1,1
+OTHER,Sony12,1,-1,21
+"""
+
+def test_irdb_csv():
+    codes = [(name, str(code)) for name, code in read_irdb_csv(IRDB.splitlines(True))]
+    assert codes == [
+        ("POWER", "nec:cm=3:04,08"),
+        ("INPUT", "nec:cm=1:04,20,09"),
+        ("VOL+", "rc5:0,16"),
+    ]
+
+FLIPPER = """Filetype: IR signals file
+Version: 1
+#
+name: Power
+type: parsed
+protocol: NEC
+address: 04 00 00 00
+command: 08 00 00 00
+#
+name: Input
+type: parsed
+protocol: NECext
+address: 04 20 00 00
+command: 09 F6 00 00
+#
+name: Vol_up
+type: parsed
+protocol: RC5
+address: 00 00 00 00
+command: 10 00 00 00
+#
+name: Learned
+type: raw
+frequency: 36000
+duty_cycle: 0.330000
+data: 900 900 1800
+data: 900 900
+"""
+
+def test_flipper():
+    codes = [(name, str(code)) for name, code in read_flipper(FLIPPER.splitlines(True))]
+    assert codes == [
+        ("Power", "nec:cm=3:04,08"),
+        ("Input", "nec:cm=1:04,20,09"),
+        ("Vol_up", "rc5:0,16"),
+        ("Learned", "raw:f=36000:900,900,1800,900,900,1000"),
+    ]
+    # Parsed codes round trip through their string form
+    for name, s in codes:
+        assert str(from_string(s)) == s
+
+def test_flipper_bad_address():
+    with pytest.raises(ParseError, match="invalid address"):
+        list(read_flipper(FLIPPER.replace("address: 04 00 00 00", "address: zz").splitlines(True)))
+
+@pytest.mark.parametrize("path, kind", [
+    ("tv.ir", "flipper"),
+    ("codes/Samsung.CSV", "irdb"),
+    ("remotes/tv.lircd.conf", "lirc"),
+    ("lircd.conf.d", "lirc"),
+    ("README.md", None),
+])
+def test_find_importer(path, kind):
+    assert find_importer(path) == kind